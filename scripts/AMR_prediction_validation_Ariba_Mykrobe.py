@@ -1,5 +1,5 @@
-import pandas as pd
-import os
+from ariba_rules import update_rules, NA
+from mykrobe_store import update_store
 
 # res2Drug={"ethambutol":'conferring resistance to ethambutol',"isoniazid":'conferring resistance to isoniazid',"pyrazinamide":'conferring resistance to pyrazinamide',"rifampicin":'conferring resistance to rifampicin'}
 res2Drug = {
@@ -8,65 +8,41 @@ res2Drug = {
     "pyrazinamide": "pyrazinamide",
     "rifampicin": "rifampicin",
 }
+# True: compute the cluster match flags from report.tsv (ariba_report.cluster_match()) instead of
+# reading summary_output_full/<sra>_summary.csv, so ariba summary need not be run
+NATIVE_MATCH = False
+
+# accession x drug R/S calls of the rule-based Ariba method (ariba_rules.py), updated once for all drugs
+ariba_calls = None
+
 
 # function for loop prediction
 # get prediction for drug named antibio on isolates listed in sra_l
 def get_ariba_prediction(sra_l, antibio):
+    global ariba_calls
+    if ariba_calls is None:
+        # R if a nonsyn known variant or a present gene of a matched cluster confers resistance to the drug
+        ariba_calls = update_rules(sra_l, native_match=NATIVE_MATCH)
+    else:
+        # the isolates of the other drugs are mostly called already
+        ariba_calls.update(sra_l, native_match=NATIVE_MATCH)
+        ariba_calls.save()
+    # NA for isolates without a report, counted by prediction_validation()
+    return ariba_calls.predictions(sra_l, antibio)
+
 
-    # n_sra=len(df_phyno)
-    ariba_pre = []
-
-    for sra in sra_l:
-        # get Ariba prediction into df_pre
-        summary = "summary_output_full/" + sra + "_summary.csv"
-        ariba_output = "aribaResult_withBam/outRun_" + sra + "/report.tsv"
-        df = pd.read_csv(ariba_output, sep="\t")
-        df_summary = pd.read_csv(summary, sep=",")
-        n_row = len(df)
-        dic1 = {}
-        dic1["SRA"] = sra
-        temp = res2Drug.copy()
-        for i in range(0, n_row):
-            for drug, drugResis in temp.items():
-                # if this is nonsyn variant or gene present conferring  resistance to a drug, predicted AMR will be R for the drug
-                if (
-                    df["has_known_var"][i] == "1"
-                    and df["ref_ctg_effect"][i] == "NONSYN"
-                    and drugResis in df["var_description"][i]
-                ) or (
-                    df["gene"][i] == "1"
-                    and df["var_only"][i] == "0"
-                    and drugResis in df["free_text"][i]
-                    and df_summary[df["cluster"][i] + ".match"][0] == "yes"
-                ):
-                    dic1[drug] = "R"
-                    # assume one row in report won't show AMR for multiple drug
-                    #del temp[drug]
-        for drug, drugResis in temp.items():
-            dic1[drug] = "S"
-
-        ariba_pre.append(dic1[antibio])
-
-    return ariba_pre
+# accession x drug table of the Mykrobe calls, collected (and updated) once for all drugs
+mykrobe_calls = None
 
 
 # get Mykrobe prediction in df_pre
 # get prediction for drug named antibio on isoforms listed in sra_l
 def get_mykrobe_prediction(sra_l, antibio):
-
-    mykrobe_pre = []
-    for sra in sra_l:
-        my_out = "mykrobeOut/result_" + sra + ".csv"
-        if os.path.isfile(my_out):
-            df = pd.read_csv(my_out, sep=",")
-            n_row = len(df)
-            for i in range(0, n_row):
-                if df["drug"][i].lower() == antibio:
-                    mykrobe_pre.append(df["susceptibility"][i])
-        else:
-            mykrobe_pre.append("S")
-
-    return mykrobe_pre
+    global mykrobe_calls
+    if mykrobe_calls is None:
+        mykrobe_calls, _ = update_store(out_dir="mykrobeOut")
+    # S for isolates without a Mykrobe result
+    return mykrobe_calls.predictions(sra_l, antibio, default="S")
 
 
 def prediction_validation(antibio_drug):
@@ -118,8 +94,14 @@ def prediction_validation(antibio_drug):
             elif dic_pre[method][i_sra] == "R" and pheno[i_sra] == "1":
                 fn += 1
                 match = 0
+            elif dic_pre[method][i_sra] == NA:
+                n_na += 1
+                match = 0
             m_list.append(match)
 
+        if n_na:
+            print("NA (no report):", n_na)
+
         print("tp:", tp, ",", "tn:", tn, ",", "fp:", fp, ",", "fn:", fn)
         print("Accuracy:" + str((tp + tn) / float(tp + tn + fp + fn)))
         print("Specificity:" + str(tn / float(tn + fp)))
@@ -1,10 +1,13 @@
 import numpy as np
 import joblib
+from argparse import ArgumentParser
 from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier
 from sklearn.model_selection import cross_validate
 from sklearn.metrics import confusion_matrix, make_scorer
 from sklearn.preprocessing import StandardScaler
+from feature_dataset import load_dataset
+from feature_vocabulary import FeatureVocabulary, model_vocab_path
 
 # List of drugs
 drugL = ["ethambutol", "isoniazid", "pyrazinamide", "rifampicin"]
@@ -65,40 +68,65 @@ def save_model(model, filename):
     """
     joblib.dump(model, filename)
 
-# Process data and evaluate models for each drug
-for drug in drugL:
-    print(f"Evaluating models for drug: {drug}")
-
-    # Load feature matrix and labels
-    X = np.loadtxt(f"featureM_X_{drug}.txt", dtype="i4")
-    y = np.loadtxt(f"label_Y_{drug}.txt", dtype="i4")
-
-    # Standardize features
-    scaler = StandardScaler()
-    X = scaler.fit_transform(X)
-
-    # Define models
-    rf_model = RandomForestClassifier(n_estimators=1000, random_state=0, n_jobs=-1)
-    lr_model = LogisticRegression(n_jobs=-1, penalty="l2", random_state=0)
-
-    # Train and save Random Forest model
-    rf_model.fit(X, y)
-    save_model(rf_model, f"random_forest_{drug}.joblib")
-
-    # Evaluate Random Forest
-    rf_metrics = evaluate_model(rf_model, X, y, scoring)
-    print("Random Forest Results:")
-    for metric, value in rf_metrics.items():
-        print(f"{metric}: {value:.4f}")
-
-    # Train and save Logistic Regression model
-    lr_model.fit(X, y)
-    save_model(lr_model, f"logistic_regression_{drug}.joblib")
-
-    # Evaluate Logistic Regression
-    lr_metrics = evaluate_model(lr_model, X, y, scoring)
-    print("Logistic Regression Results:")
-    for metric, value in lr_metrics.items():
-        print(f"{metric}: {value:.4f}")
-
-    print("\n")
+def getArgs():
+    parser = ArgumentParser(
+        prog="RF_LR_validation_multiMetricCalculated.py",
+        description="Train, save and cross-validate RF and LR models for the 4 first-line TB drugs.",
+    )
+    parser.add_argument(
+        "--no_scale",
+        action="store_true",
+        help="Do not standardize the features (they are 0/1 and RF does not need it)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    # Process data and evaluate models for each drug
+    for drug in drugL:
+        print(f"Evaluating models for drug: {drug}")
+
+        # Load feature matrix and labels, kept as a sparse CSR matrix
+        X, y, _, feature_names = load_dataset(drug, sparse=True)
+        X = X.astype(np.float64)
+        # predict.py checks the features of new isolates against the columns the models were trained on
+        FeatureVocabulary(feature_names).save(model_vocab_path(drug))
+
+        # Standardize features without centering, which would make the matrix dense
+        scaler = None
+        if not args.no_scale:
+            scaler = StandardScaler(with_mean=False)
+            X = scaler.fit_transform(X)
+        # predict.py scales new isolates with the same scaler
+        save_model(scaler, f"scaler_{drug}.joblib")
+
+        # Define models; liblinear works on the sparse matrix directly
+        rf_model = RandomForestClassifier(n_estimators=1000, random_state=0, n_jobs=-1)
+        lr_model = LogisticRegression(penalty="l2", solver="liblinear", random_state=0)
+
+        # Train and save Random Forest model
+        rf_model.fit(X, y)
+        save_model(rf_model, f"random_forest_{drug}.joblib")
+
+        # Evaluate Random Forest
+        rf_metrics = evaluate_model(rf_model, X, y, scoring)
+        print("Random Forest Results:")
+        for metric, value in rf_metrics.items():
+            print(f"{metric}: {value:.4f}")
+
+        # Train and save Logistic Regression model
+        lr_model.fit(X, y)
+        save_model(lr_model, f"logistic_regression_{drug}.joblib")
+
+        # Evaluate Logistic Regression
+        lr_metrics = evaluate_model(lr_model, X, y, scoring)
+        print("Logistic Regression Results:")
+        for metric, value in lr_metrics.items():
+            print(f"{metric}: {value:.4f}")
+
+        print("\n")
+
+
+if __name__ == "__main__":
+    main()
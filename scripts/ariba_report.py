@@ -0,0 +1,132 @@
+"""
+Shared parser for the ariba report file (report.tsv) and ariba summary file (<sra>_summary.csv)
+of one isolate. Feature IDs are derived column-wise for all rows of a report at once instead of
+looping rows and indexing the DataFrame cell by cell. The cluster match flags of the summary can
+also be computed from the report alone (cluster_match()), so ariba summary need not be run.
+"""
+
+import numpy as np
+import pandas as pd
+
+# ariba summary --min_id default, report rows below it are ignored
+MIN_ID = 90.0
+# bits of the flag column (ariba/flag.py)
+_ASSEMBLED = 1
+_ASSEMBLED_INTO_ONE_CONTIG = 2
+_COMPLETE_GENE = 8
+_ASSEMBLY_FAIL = 64
+_REF_SEQ_CHOOSE_FAIL = 1024
+
+
+def read_report(report_path):
+    """
+    Read an ariba report file. All columns are kept as strings, the way ariba writes them,
+    so that flags such as gene or known_var compare as '0'/'1'/'.' whatever pandas would infer.
+    """
+    return pd.read_csv(report_path, sep="\t", dtype=str, keep_default_na=False)
+
+
+def read_cluster_match(summary_path):
+    """
+    Return a Series that maps every cluster in an ariba summary file to its match value
+    ('yes' or 'no'), i.e. the '<cluster>.match' columns of the first row.
+    """
+    df_summary = pd.read_csv(summary_path, sep=",", dtype=str, keep_default_na=False)
+    row = df_summary.iloc[0]
+    match_cols = row.index[row.index.str.endswith(".match")]
+    return pd.Series(
+        row[match_cols].values, index=[c[: -len(".match")] for c in match_cols]
+    )
+
+
+def kept_rows(report_df, min_id=MIN_ID):
+    """Rows of a report that ariba summary uses: those of at least min_id percent identity ('.' has none)"""
+    pc_ident = pd.to_numeric(report_df["pc_ident"], errors="coerce")
+    return report_df[pc_ident >= min_id]
+
+
+def cluster_match(report_df, min_id=MIN_ID):
+    """
+    The '<cluster>.match' values ariba summary --preset all_no_filter derives from a report, as
+    read_cluster_match() returns them. A cluster is listed if it has a row of at least min_id
+    percent identity and matches ('yes') if it is assembled into one contig (with a complete gene
+    for coding sequences), without assembly failure, and is either not a variant-only reference
+    or has a known variant. Its first listed row holds the flag, gene and var_only columns.
+    """
+    kept = kept_rows(report_df, min_id).groupby("cluster", sort=False)
+    rows = kept.first()
+    flag = rows["flag"].astype(int)
+    has_complete_gene = (rows["gene"] == "0") | (flag & _COMPLETE_GENE != 0)
+    assembled = (
+        (flag & (_ASSEMBLY_FAIL | _REF_SEQ_CHOOSE_FAIL) == 0)
+        & (flag & _ASSEMBLED != 0)
+        & (flag & _ASSEMBLED_INTO_ONE_CONTIG != 0)
+        & has_complete_gene
+    )
+    has_known_var = kept["has_known_var"].agg(lambda v: (v == "1").any())
+    match = assembled & ((rows["var_only"] == "0") | has_known_var)
+    return pd.Series(
+        np.where(match, "yes", "no"), index=rows.index.to_numpy(dtype=object)
+    )
+
+
+def variant_ids(report_df):
+    """
+    Variant ID of every report row: ref_name.known_var_change for detected known variants,
+    ref_name.ref_ctg_change otherwise.
+    """
+    is_known = (report_df["known_var"] == "1") & (report_df["has_known_var"] == "1")
+    change = report_df["ref_ctg_change"].where(~is_known, report_df["known_var_change"])
+    return (report_df["ref_name"] + "." + change).to_numpy(dtype=object)
+
+
+def feature_ids(report_df, cluster_match):
+    """
+    Derive the genetic features of one isolate from its report rows whose cluster is matched:
+    gene presents (ref_name), novel variants on coding genes (ref_name.ref_ctg_change) and
+    detected known variants (ref_name.known_var_change).
+    Return the unique feature IDs as an array, in the order they first appear in the report.
+    """
+    matched = report_df["cluster"].map(cluster_match).to_numpy(dtype=object) == "yes"
+    known_var = report_df["known_var"].to_numpy(dtype=object)
+    is_present = known_var == "."
+    is_novel = (known_var == "0") & (report_df["gene"].to_numpy(dtype=object) == "1")
+    is_known = (known_var == "1") & (
+        report_df["has_known_var"].to_numpy(dtype=object) == "1"
+    )
+    ref_name = report_df["ref_name"].to_numpy(dtype=object)
+    ids = np.select(
+        [is_present, is_novel | is_known],
+        [ref_name, variant_ids(report_df)],
+        default=None,
+    )
+    keep = matched & (is_present | is_novel | is_known)
+    return pd.unique(ids[keep])
+
+
+def parse_report_features(summary_path, report_path):
+    """
+    Read the summary and report file of one isolate and return its feature IDs. Without a
+    summary_path (None) the cluster match flags are computed from the report.
+    """
+    report_df = read_report(report_path)
+    if summary_path is None:
+        return feature_ids(report_df, cluster_match(report_df))
+    return feature_ids(report_df, read_cluster_match(summary_path))
+
+
+def feature_vector(vocab, summary_path, report_path, lineage=None):
+    """
+    0/1 feature vector of one isolate with columns in the order of vocab (a FeatureVocabulary):
+    its features parsed from the summary and report file plus its lineage. Features and lineages
+    that are not in vocab are ignored. summary_path may be None, see parse_report_features().
+    """
+    f_vector = np.zeros(len(vocab), dtype=np.int8)
+    f_vector[
+        vocab.indices(
+            parse_report_features(summary_path, report_path), skip_unknown=True
+        )
+    ] = 1
+    if lineage in vocab:
+        f_vector[vocab.index(lineage)] = 1
+    return f_vector
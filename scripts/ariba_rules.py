@@ -0,0 +1,282 @@
+"""
+Rule-based ARIBA resistance calls (the simple baseline of AMR_prediction_validation_Ariba_Mykrobe.py)
+for all drugs at once. An isolate is called resistant (R) to a drug if its report has
+  - a detected known variant with a non-synonymous effect whose var_description names the drug, or
+  - a present gene (gene 1, var_only 0) of a matched cluster whose free_text names the drug,
+and susceptible (S) otherwise; isolates without a report are NA. Each report is read once and the rules are evaluated column-wise
+for every row and drug. The accession x drug calls are kept in ariba_rules.npz, next to the
+feature store, and only isolates whose report or summary changed are called again.
+"""
+
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from ariba_report import cluster_match, read_cluster_match, read_report
+from signed_files import SignedFiles
+
+RULES_PATH = "ariba_rules.npz"
+DRUGS = ["ethambutol", "isoniazid", "pyrazinamide", "rifampicin"]
+ARIBA_OUT = "aribaResult_withBam"
+SUMMARY_OUT = "summary_output_full"
+# call of an isolate without a report
+NA = "NA"
+
+
+def ariba_paths(sra, ariba_out=ARIBA_OUT, summary_out=SUMMARY_OUT, native_match=False):
+    """Summary (None with native_match) and report file of sra"""
+    summary = None if native_match else os.path.join(summary_out, sra + "_summary.csv")
+    return summary, os.path.join(ariba_out, "outRun_" + sra, "report.tsv")
+
+
+def resistance_calls(report_df, match, drugs=DRUGS):
+    """
+    Boolean array with one entry per drug: True if a row of report_df calls the isolate resistant
+    to the drug. match maps clusters to their match flag ('yes'/'no'), clusters missing from it
+    are not matched.
+    """
+    known_nonsyn = (report_df["has_known_var"] == "1") & (
+        report_df["ref_ctg_effect"] == "NONSYN"
+    )
+    present = (
+        (report_df["gene"] == "1")
+        & (report_df["var_only"] == "0")
+        & (report_df["cluster"].map(match) == "yes")
+    )
+    return np.array(
+        [
+            (
+                (
+                    known_nonsyn
+                    & report_df["var_description"].str.contains(drug, regex=False)
+                )
+                | (present & report_df["free_text"].str.contains(drug, regex=False))
+            ).any()
+            for drug in drugs
+        ],
+        dtype=bool,
+    )
+
+
+def call_isolate(summary_path, report_path, drugs=DRUGS):
+    """Resistance calls (see resistance_calls()) of one isolate; summary_path None computes the match flags from the report"""
+    report_df = read_report(report_path)
+    if summary_path is None:
+        match = cluster_match(report_df)
+    else:
+        match = read_cluster_match(summary_path)
+    return resistance_calls(report_df, match, drugs)
+
+
+def calls_to_labels(calls):
+    return np.where(calls, "R", "S")
+
+
+class RuleStore(object):
+    """Resistance calls of every called isolate plus the signature of the files they came from"""
+
+    def __init__(self, drugs=DRUGS):
+        self.drugs = list(drugs)
+        self.calls = {}
+        # report and summary file of every isolate
+        self.files = SignedFiles(2)
+
+    def __len__(self):
+        return len(self.calls)
+
+    def is_current(self, sra, summary_path, report_path):
+        """True if the stored calls of sra come from the current report and summary, see FeatureStore.is_current()"""
+        return sra in self.calls and self.files.is_current(
+            sra, report_path, summary_path
+        )
+
+    def put(self, sra, calls, summary_path, report_path):
+        self.calls[sra] = calls
+        self.files.sign(sra, report_path, summary_path)
+
+    def update(
+        self,
+        sra_list,
+        ariba_out=ARIBA_OUT,
+        summary_out=SUMMARY_OUT,
+        native_match=False,
+        workers=1,
+    ):
+        """
+        Call the isolates of sra_list that are new or whose ariba output changed, workers processes
+        at a time. Return the accessions in sra_list that have a report file; the others are
+        counted and get NA from predictions().
+        """
+        sra_withReport = []
+        changed = []
+        missing = 0
+        for sra in sra_list:
+            summary, report = ariba_paths(sra, ariba_out, summary_out, native_match)
+            if os.path.isfile(report):
+                sra_withReport.append(sra)
+                if not self.is_current(sra, summary, report):
+                    changed.append((sra, summary, report))
+            else:
+                missing += 1
+        if missing:
+            print(
+                "{} of {} isolates have no ARIBA report".format(missing, len(sra_list))
+            )
+        results = Parallel(n_jobs=workers)(
+            delayed(call_isolate)(summary, report, self.drugs)
+            for _, summary, report in changed
+        )
+        for (sra, summary, report), calls in zip(changed, results):
+            self.put(sra, calls, summary, report)
+        return sra_withReport
+
+    def matrix(self, sra_list=None):
+        """R/S calls as a DataFrame, one row per accession (default: all called) and one column per drug"""
+        if sra_list is None:
+            sra_list = list(self.calls)
+        calls = np.array([self.calls[sra] for sra in sra_list], dtype=bool).reshape(
+            len(sra_list), len(self.drugs)
+        )
+        return pd.DataFrame(
+            calls_to_labels(calls),
+            index=pd.Index(sra_list, name="SRA"),
+            columns=self.drugs,
+        )
+
+    def predictions(self, sra_list, drug, default=NA):
+        """R/S calls of sra_list for drug, default for isolates that were not called"""
+        k = self.drugs.index(drug)
+        return [
+            ("R" if self.calls[sra][k] else "S") if sra in self.calls else default
+            for sra in sra_list
+        ]
+
+    def save(self, path=RULES_PATH):
+        accessions = list(self.calls)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                drugs=np.array(self.drugs, dtype=str),
+                accessions=np.array(accessions, dtype=str),
+                calls=np.array(
+                    [self.calls[sra] for sra in accessions], dtype=bool
+                ).reshape(len(accessions), len(self.drugs)),
+                **self.files.arrays(accessions),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=RULES_PATH):
+        with np.load(path) as data:
+            store = cls(data["drugs"].tolist())
+            accessions = data["accessions"].tolist()
+            for i, sra in enumerate(accessions):
+                store.calls[sra] = data["calls"][i]
+            store.files.load_arrays(accessions, data)
+        return store
+
+
+def update_rules(
+    sra_list,
+    path=RULES_PATH,
+    ariba_out=ARIBA_OUT,
+    summary_out=SUMMARY_OUT,
+    native_match=False,
+    workers=1,
+    drugs=DRUGS,
+):
+    """
+    Load the calls at path (a store with other drugs is started anew), call the new and changed
+    isolates of sra_list and save the store. Return the store.
+    """
+    store = RuleStore(drugs)
+    if os.path.isfile(path):
+        loaded = RuleStore.load(path)
+        if loaded.drugs == store.drugs:
+            store = loaded
+    store.update(sra_list, ariba_out, summary_out, native_match, workers)
+    store.save(path)
+    return store
+
+
+def predict_isolate(sra, drugs=DRUGS, native_match=True):
+    """R/S calls of one isolate as a dict drug -> call, e.g. as a baseline next to predict.py"""
+    summary, report = ariba_paths(sra, native_match=native_match)
+    return dict(
+        zip(drugs, calls_to_labels(call_isolate(summary, report, drugs)).tolist())
+    )
+
+
+def getArgs():
+    parser = ArgumentParser(
+        prog="ariba_rules.py",
+        description="Rule-based ARIBA R/S calls of every isolate for the 4 first-line TB drugs.",
+    )
+    parser.add_argument(
+        "-a",
+        "--ariba_out",
+        default=ARIBA_OUT,
+        help="ARIBA output directory (default: {})".format(ARIBA_OUT),
+    )
+    parser.add_argument(
+        "-s",
+        "--summary_out",
+        default=SUMMARY_OUT,
+        help="Directory of <sra>_summary.csv (default: {})".format(SUMMARY_OUT),
+    )
+    parser.add_argument(
+        "--native_match",
+        action="store_true",
+        help="Compute the cluster match flags from report.tsv instead of reading the summary",
+    )
+    parser.add_argument(
+        "--store",
+        default=RULES_PATH,
+        help="Store of the calls, only new or changed isolates are called (default: {})".format(
+            RULES_PATH
+        ),
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of parallel processes (default: 1)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="Also write the accession x drug calls to this tsv",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    sra_list = sorted(
+        name[len("outRun_") :]
+        for name in os.listdir(args.ariba_out)
+        if name.startswith("outRun_")
+    )
+    store = update_rules(
+        sra_list,
+        args.store,
+        args.ariba_out,
+        args.summary_out,
+        args.native_match,
+        args.workers,
+    )
+    print(
+        "{} isolates x {} drugs in {}".format(len(store), len(store.drugs), args.store)
+    )
+    if args.output:
+        store.matrix().to_csv(args.output, sep="\t")
+
+
+if __name__ == "__main__":
+    main()
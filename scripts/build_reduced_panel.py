@@ -0,0 +1,246 @@
+"""
+Build a reduced ARIBA reference panel (fasta + metadata tsv) that only holds the reference
+sequences the trained models and the rule-based prediction need:
+  - the genes of the selected features (raw_fList_final.txt or other feature lists),
+  - the genes of the CNN variants and gene presents (baseHparamsNvars of the CNN script),
+  - the genes whose CARD description mentions one of the drugs (rule-based prediction).
+All metadata rows of a kept gene are kept, so novel variants on it are still called.
+The panel comes with a manifest holding the sha1 of the inputs and of the panel; a panel whose
+manifest matches the inputs is reused instead of rebuilt.
+Then run ARIBA on it with --ref_fasta reduced.card.fa --ref_tsv reduced.card.tsv (see prepareref_cache.py).
+"""
+
+import ast
+import hashlib
+import json
+import os
+import re
+from argparse import ArgumentParser
+
+CNN_SCRIPT = "generateInput4Conv1D_withMultiInput_N_createCNN_trainNtest_on4drugs.py"
+firstLine_TB_4antibio = ["rifampicin", "ethambutol", "isoniazid", "pyrazinamide"]
+# ariba prepareref replaces these characters of the sequence names by '_' (ref_name in reports)
+_RENAME_REGEX = re.compile(r"[^a-zA-Z0-9_.]")
+
+
+def ariba_name(name):
+    """Name of a reference sequence in ariba reports"""
+    return _RENAME_REGEX.sub("_", name)
+
+
+def sha1_file(path):
+    h = hashlib.sha1()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def read_feature_list(path):
+    with open(path) as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def cnn_features(script_path=CNN_SCRIPT):
+    """
+    Features hard coded in baseHparamsNvars of the CNN script (variants and lineageNgenePresent
+    of every drug), read from its source so that the script (and tensorflow) is not imported
+    """
+    with open(script_path) as f:
+        tree = ast.parse(f.read(), script_path)
+    features = []
+    for node in ast.walk(tree):
+        if isinstance(node, ast.FunctionDef) and node.name == "__init__":
+            args = node.args.args[len(node.args.args) - len(node.args.defaults) :]
+            for arg, default in zip(args, node.args.defaults):
+                if arg.arg in ("variants", "lineageNgenePresent"):
+                    for names in ast.literal_eval(default).values():
+                        features.extend(names)
+    return features
+
+
+def read_fasta(path):
+    """List of (name, lines of the record) of a fasta file"""
+    records = []
+    with open(path) as f:
+        for line in f:
+            if line.startswith(">"):
+                records.append((line[1:].split()[0], [line]))
+            elif records:
+                records[-1][1].append(line)
+    return records
+
+
+def read_metadata(path):
+    """List of (name, line) of an ariba metadata tsv"""
+    with open(path) as f:
+        return [(line.split("\t", 1)[0], line) for line in f if line.strip()]
+
+
+def features_to_refs(features, ref_names):
+    """
+    Map feature IDs (ref_name, ref_name.<change> or lineages) to reference sequences. Return the
+    set of matched reference names and the features that match none (e.g. lineages).
+    """
+    by_ariba_name = {ariba_name(name): name for name in ref_names}
+    refs = set()
+    unmatched = []
+    for feature in features:
+        parts = feature.split(".")
+        # the longest prefix that names a reference, as ref names contain dots
+        for k in range(len(parts), 0, -1):
+            name = by_ariba_name.get(".".join(parts[:k]))
+            if name is not None:
+                refs.add(name)
+                break
+        else:
+            unmatched.append(feature)
+    return refs, unmatched
+
+
+def rule_refs(metadata, drugs):
+    """References with a metadata row whose description mentions one of drugs"""
+    refs = set()
+    for name, line in metadata:
+        description = line.rstrip("\n").split("\t")[-1].lower()
+        if any(drug in description for drug in drugs):
+            refs.add(name)
+    return refs
+
+
+def build_panel(fasta_path, tsv_path, features, drugs, out_prefix):
+    """
+    Write <out_prefix>.fa, <out_prefix>.tsv and <out_prefix>.manifest.json and return the
+    manifest. An existing panel built from the same inputs is reused.
+    """
+    fasta = read_fasta(fasta_path)
+    metadata = read_metadata(tsv_path)
+    refs, unmatched = features_to_refs(features, [name for name, _ in fasta])
+    refs |= rule_refs(metadata, drugs)
+    refs = sorted(refs)
+    key = hashlib.sha1(
+        json.dumps(
+            [sha1_file(fasta_path), sha1_file(tsv_path), refs], separators=(",", ":")
+        ).encode()
+    ).hexdigest()
+
+    fa_path, out_tsv, manifest_path = (
+        out_prefix + ".fa",
+        out_prefix + ".tsv",
+        out_prefix + ".manifest.json",
+    )
+    if os.path.isfile(manifest_path):
+        with open(manifest_path) as f:
+            manifest = json.load(f)
+        if (
+            manifest.get("key") == key
+            and os.path.isfile(fa_path)
+            and os.path.isfile(out_tsv)
+            and sha1_file(fa_path) == manifest["fasta_sha1"]
+            and sha1_file(out_tsv) == manifest["tsv_sha1"]
+        ):
+            manifest["cached"] = True
+            return manifest
+
+    keep = set(refs)
+    with open(fa_path + ".tmp", "w") as f:
+        for name, lines in fasta:
+            if name in keep:
+                f.writelines(lines)
+    with open(out_tsv + ".tmp", "w") as f:
+        f.writelines(line for name, line in metadata if name in keep)
+    os.replace(fa_path + ".tmp", fa_path)
+    os.replace(out_tsv + ".tmp", out_tsv)
+    manifest = {
+        "key": key,
+        "source_fasta": fasta_path,
+        "source_tsv": tsv_path,
+        "fasta": fa_path,
+        "tsv": out_tsv,
+        "fasta_sha1": sha1_file(fa_path),
+        "tsv_sha1": sha1_file(out_tsv),
+        "drugs": list(drugs),
+        "n_source_refs": len(fasta),
+        "refs": refs,
+        "unmatched_features": sorted(set(unmatched)),
+    }
+    with open(manifest_path, "w") as f:
+        json.dump(manifest, f, indent=1)
+    manifest["cached"] = False
+    return manifest
+
+
+def getArgs():
+    parser = ArgumentParser(
+        prog="build_reduced_panel.py",
+        description="Build a reduced ARIBA reference panel with only the genes used by the models and the rule-based prediction.",
+    )
+    parser.add_argument(
+        "-f",
+        "--fasta",
+        default="out1.card.fa",
+        help="Reference fasta (default: out1.card.fa)",
+    )
+    parser.add_argument(
+        "-m",
+        "--tsv",
+        default="out1.card.tsv",
+        help="Reference metadata tsv (default: out1.card.tsv)",
+    )
+    parser.add_argument(
+        "-l",
+        "--features",
+        nargs="*",
+        default=["raw_fList_final.txt"],
+        help="Feature lists, one feature per line (default: raw_fList_final.txt)",
+    )
+    parser.add_argument(
+        "-c",
+        "--cnn_script",
+        default=CNN_SCRIPT,
+        help="CNN script whose variants are kept, '' for none (default: {})".format(
+            CNN_SCRIPT
+        ),
+    )
+    parser.add_argument(
+        "-d",
+        "--drugs",
+        nargs="*",
+        default=firstLine_TB_4antibio,
+        help="Drugs of the rule-based prediction (default: the 4 first-line drugs)",
+    )
+    parser.add_argument(
+        "-o",
+        "--out_prefix",
+        default="reduced.card",
+        help="Output prefix (default: reduced.card)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    features = []
+    for path in args.features:
+        features.extend(read_feature_list(path))
+    if args.cnn_script:
+        features.extend(cnn_features(args.cnn_script))
+    manifest = build_panel(args.fasta, args.tsv, features, args.drugs, args.out_prefix)
+    print(
+        "{} panel {} ({} of {} references), {} features without reference".format(
+            "Reusing" if manifest["cached"] else "Built",
+            manifest["key"],
+            len(manifest["refs"]),
+            manifest["n_source_refs"],
+            len(manifest["unmatched_features"]),
+        )
+    )
+    print(
+        "Run ARIBA with --ref_fasta {} --ref_tsv {}".format(
+            manifest["fasta"], manifest["tsv"]
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,250 @@
+"""
+Compaction of an ARIBA output directory (outRun_<sra>) to what the downstream scripts read:
+report.tsv, the cluster match flags and the read depths of the windows around every variant
+locus of the report (from clusters/<cluster>/assembly.reads_mapped.bam.read_depths.gz), all in
+one small compact.npz next to report.tsv. With prune, everything else (BAMs, assemblies, full
+read depth files, ...) is deleted; report.tsv is kept for ariba summary and the feature scripts.
+read_depth_table() serves the depth windows to the CNN scripts from either layout.
+"""
+
+import gzip
+import io
+import os
+import shutil
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+
+from ariba_report import cluster_match, read_cluster_match, read_report
+
+COMPACT_NAME = "compact.npz"
+# window_size of the CNN scripts
+DEPTH_WINDOW = 21
+DEPTH_NAME = "assembly.reads_mapped.bam.read_depths.gz"
+DEPTH_COLUMNS = 6
+
+
+def cluster_depth_path(out_run_dir, cluster):
+    return os.path.join(out_run_dir, "clusters", cluster, DEPTH_NAME)
+
+
+def variant_loci(report_df):
+    """Map cluster -> contig -> set of the contig positions (ctg_start) of the variants of the report"""
+    has_var = (report_df["ctg_start"] != ".") & (
+        (report_df["ref_ctg_change"] != ".") | (report_df["known_var_change"] != ".")
+    )
+    loci = {}
+    for cluster, ctg, pos in report_df.loc[
+        has_var, ["cluster", "ctg", "ctg_start"]
+    ].itertuples(index=False):
+        loci.setdefault(cluster, {}).setdefault(ctg, set()).add(int(pos))
+    return loci
+
+
+def depth_windows(depth_path, ctg_loci, window=DEPTH_WINDOW):
+    """
+    Lines (line number, text) of a read depth file within window // 2 + 1 positions of the loci
+    of ctg_loci (contig -> positions). The extra position and the line numbers let
+    read_depth_table() return the rows with the same index as when reading the whole file.
+    """
+    half = window // 2 + 1
+    wanted = {
+        ctg: {p for pos in positions for p in range(pos - half, pos + half + 1)}
+        for ctg, positions in ctg_loci.items()
+    }
+    rows = []
+    with gzip.open(depth_path, "rt") as f:
+        for n, line in enumerate(f):
+            ctg, pos, _ = line.split("\t", 2)
+            if ctg in wanted and int(pos) in wanted[ctg]:
+                rows.append((n, line))
+    return rows
+
+
+def dir_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, name))
+        for root, _, names in os.walk(path)
+        for name in names
+    )
+
+
+def compact_run(out_run_dir, summary_path=None, window=DEPTH_WINDOW, prune=False):
+    """
+    Write <out_run_dir>/compact.npz and, if prune, delete everything but report.tsv and
+    compact.npz. The match flags are read from summary_path if it exists, otherwise they are
+    computed from the report (ariba_report.cluster_match()). Return the size of the directory
+    before and after in bytes.
+    """
+    report_path = os.path.join(out_run_dir, "report.tsv")
+    size_before = dir_size(out_run_dir)
+    with open(report_path) as f:
+        report_text = f.read()
+    report_df = read_report(io.StringIO(report_text))
+    if summary_path is not None and os.path.isfile(summary_path):
+        match = read_cluster_match(summary_path)
+    else:
+        match = cluster_match(report_df)
+
+    depth_clusters, depth_lines, depth_rows = [], [], []
+    for cluster, ctg_loci in variant_loci(report_df).items():
+        depth_path = cluster_depth_path(out_run_dir, cluster)
+        if not os.path.isfile(depth_path):
+            continue
+        for n, line in depth_windows(depth_path, ctg_loci, window):
+            depth_clusters.append(cluster)
+            depth_lines.append(n)
+            depth_rows.append(line)
+
+    compact_path = os.path.join(out_run_dir, COMPACT_NAME)
+    # np.savez appends .npz to names without it
+    tmp_path = compact_path[: -len(".npz")] + ".tmp.npz"
+    np.savez_compressed(
+        tmp_path,
+        report=np.array(report_text),
+        match_clusters=np.array(match.index, dtype=str),
+        match_values=np.array(match.values, dtype=str),
+        depth_clusters=np.array(depth_clusters, dtype=str),
+        depth_lines=np.array(depth_lines, dtype=np.int64),
+        depth_rows=np.array(depth_rows, dtype=str),
+        window=np.array(window),
+    )
+    os.replace(tmp_path, compact_path)
+
+    if prune:
+        for name in os.listdir(out_run_dir):
+            if name in ("report.tsv", COMPACT_NAME):
+                continue
+            path = os.path.join(out_run_dir, name)
+            if os.path.isdir(path) and not os.path.islink(path):
+                shutil.rmtree(path)
+            else:
+                os.unlink(path)
+    return size_before, dir_size(out_run_dir)
+
+
+def load_compact(out_run_dir):
+    with np.load(os.path.join(out_run_dir, COMPACT_NAME)) as data:
+        return {key: data[key] for key in data.files}
+
+
+def compact_report(out_run_dir):
+    """The report of a compacted run, as ariba_report.read_report() returns it"""
+    return read_report(io.StringIO(str(load_compact(out_run_dir)["report"])))
+
+
+def compact_match(out_run_dir):
+    """The cluster match flags of a compacted run, as ariba_report.read_cluster_match() returns them"""
+    data = load_compact(out_run_dir)
+    return pd.Series(data["match_values"], index=data["match_clusters"], dtype=object)
+
+
+def read_depth_table(ariba_result_dir, sra, cluster):
+    """
+    Read depth table of a cluster of sra as pd.read_csv(<read_depths.gz>, header=None, sep="\\t")
+    returns it: from the cluster directory if it is still there, otherwise the rows of the
+    variant windows kept in compact.npz (indexed by their line numbers in the full file).
+    """
+    out_run_dir = os.path.join(ariba_result_dir, "outRun_" + sra)
+    depth_path = cluster_depth_path(out_run_dir, cluster)
+    if os.path.isfile(depth_path):
+        return pd.read_csv(depth_path, header=None, sep="\t")
+    data = load_compact(out_run_dir)
+    keep = data["depth_clusters"] == cluster
+    if not keep.any():
+        return pd.DataFrame(columns=range(DEPTH_COLUMNS))
+    df = pd.read_csv(
+        io.StringIO("".join(data["depth_rows"][keep])), header=None, sep="\t"
+    )
+    df.index = data["depth_lines"][keep]
+    return df
+
+
+def getArgs():
+    parser = ArgumentParser(
+        prog="compact_ariba.py",
+        description="Compact ARIBA output directories to report.tsv, cluster match flags and variant read depth windows.",
+    )
+    parser.add_argument(
+        "-a",
+        "--ariba_out",
+        default="aribaResult_withBam",
+        help="ARIBA output directory (default: aribaResult_withBam)",
+    )
+    parser.add_argument(
+        "-s",
+        "--summary_out",
+        default="summary_output_full",
+        help="Directory of <sra>_summary.csv to take the match flags from (default: summary_output_full)",
+    )
+    parser.add_argument(
+        "--window",
+        type=int,
+        default=DEPTH_WINDOW,
+        help="Read depth window around each variant locus (default: {})".format(
+            DEPTH_WINDOW
+        ),
+    )
+    parser.add_argument(
+        "--prune",
+        action="store_true",
+        help="Delete everything but report.tsv and compact.npz after compaction",
+    )
+    parser.add_argument(
+        "--redo",
+        action="store_true",
+        help="Compact runs that already have a compact.npz again",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of parallel processes (default: 1)",
+    )
+    return parser.parse_args()
+
+
+def _compact_one(ariba_out, summary_out, sra, window, prune):
+    out_run_dir = os.path.join(ariba_out, "outRun_" + sra)
+    summary_path = os.path.join(summary_out, sra + "_summary.csv")
+    try:
+        return sra, compact_run(out_run_dir, summary_path, window, prune)
+    except Exception as e:
+        print("[ERROR] {}: {}".format(sra, e))
+        return sra, None
+
+
+def main():
+    args = getArgs()
+    sra_list = []
+    for name in sorted(os.listdir(args.ariba_out)):
+        out_run_dir = os.path.join(args.ariba_out, name)
+        if not name.startswith("outRun_"):
+            continue
+        if not os.path.isfile(os.path.join(out_run_dir, "report.tsv")):
+            continue
+        if os.path.isfile(os.path.join(out_run_dir, COMPACT_NAME)) and not args.redo:
+            continue
+        sra_list.append(name[len("outRun_") :])
+    print("{} ARIBA runs to compact".format(len(sra_list)))
+    results = Parallel(n_jobs=args.workers)(
+        delayed(_compact_one)(
+            args.ariba_out, args.summary_out, sra, args.window, args.prune
+        )
+        for sra in sra_list
+    )
+    done = [sizes for _, sizes in results if sizes is not None]
+    before = sum(b for b, _ in done)
+    after = sum(a for _, a in done)
+    print(
+        "Compacted {} of {} runs: {:.1f} MB -> {:.1f} MB".format(
+            len(done), len(sra_list), before / 1e6, after / 1e6
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -5,14 +5,27 @@ import json
 import os
 import time
 import logging
+import threading
 from argparse import ArgumentParser
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from pathlib import Path
 import psutil
 import runAribaInLoop_withBam as ariba_runner
+import run_Mykrobe_inLoop as mykrobe_runner
+from resource_scheduler import ResourceScheduler, reserve
+from job_ledger import JobLedger, add_ledger_args, DONE, FAILED
+from prepareref_cache import add_ref_args, resolve_ref
+import fastq_stream
+from subsample_reads import subsample_to_depth, GENOME_SIZE
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
+GB = 1024 ** 3
+# fastq files written by fasterq-dump (split-3: read pairs plus unpaired reads), gzip-compressed
+# read pairs (--fastq_format gz) or named pipes (--fastq_format fifo, same names as plain fastq)
+# and the .part files of a gz stream that was killed before it completed
+FASTQ_EXTS = ("_1.fastq", "_2.fastq", ".fastq", "_1.fastq.gz", "_2.fastq.gz", "_1.fastq.gz.part", "_2.fastq.gz.part")
+
 
 def load_sra_list(path):
     p = Path(path)
@@ -39,22 +52,39 @@ def load_sra_list(path):
     return []
 
 
-def run_fasterq_dump(sra, out_dir, threads_count, retries=2, wait=5):
+def run_fasterq_dump(sra, out_dir, threads_count, retries=2, wait=5, scheduler=None, memory=1.0, ledger=None, fastq_format="fastq"):
+    """
+    Download the fastq files of sra, as plain fastq or, with fastq_format "gz", compressed on the fly
+    into <sra>_1.fastq.gz/<sra>_2.fastq.gz. Every attempt is recorded as stage "download" in the ledger if given.
+    """
     out_dir = Path(out_dir)
     out_dir.mkdir(parents=True, exist_ok=True)
-    f1 = out_dir / f"{sra}_1.fastq"
-    f2 = out_dir / f"{sra}_2.fastq"
+    f1, f2 = (Path(p) for p in fastq_stream.read_paths(sra, out_dir, fastq_format))
     if f1.exists() and f2.exists():
         logging.info("%s: fastq pair already exists, skipping download", sra)
+        if ledger is not None:
+            ledger.mark(sra, "download", DONE)
         return True
 
-    cmd = ["fasterq-dump", sra, "--threads", str(threads_count), "-O", str(out_dir)]
     for attempt in range(1, retries + 2):
-        logging.info("%s: running fasterq-dump attempt %d: %s", sra, attempt, " ".join(cmd))
         try:
-            subprocess.run(cmd, check=True)
+            # the threads and memory are only held while fasterq-dump runs, not while waiting to retry
+            with reserve(scheduler, "fasterq-dump", threads_count, memory) as threads:
+                if ledger is not None:
+                    ledger.start(sra, "download")
+                if fastq_format == "gz":
+                    logging.info("%s: running fasterq-dump attempt %d, compressing with %s", sra, attempt, fastq_stream.compressor_cmd()[0])
+                    exit_code = fastq_stream.stream_reads(sra, str(f1), str(f2), threads, compress=True)
+                    if exit_code != 0:
+                        raise subprocess.CalledProcessError(exit_code, "fasterq-dump")
+                else:
+                    cmd = ["fasterq-dump", sra, "--threads", str(threads), "-O", str(out_dir)]
+                    logging.info("%s: running fasterq-dump attempt %d: %s", sra, attempt, " ".join(cmd))
+                    subprocess.run(cmd, check=True)
         except subprocess.CalledProcessError as e:
             logging.warning("%s: fasterq-dump failed on attempt %d: %s", sra, attempt, str(e))
+            if ledger is not None:
+                ledger.finish(sra, "download", e.returncode)
             if attempt <= retries:
                 logging.info("%s: retrying after %d seconds...", sra, wait)
                 time.sleep(wait)
@@ -65,28 +95,28 @@ def run_fasterq_dump(sra, out_dir, threads_count, retries=2, wait=5):
         # success - ensure both files exist
         if f1.exists() and f2.exists():
             logging.info("%s: download complete", sra)
+            if ledger is not None:
+                ledger.finish(sra, "download", 0, bytes=f1.stat().st_size + f2.stat().st_size)
             return True
         else:
             logging.warning("%s: expected fastq pair not found after fasterq-dump", sra)
+            if ledger is not None:
+                ledger.finish(sra, "download", None, error="fastq pair not found")
             return False
 
 
-def process_sra(sra, out_dir, ariba_out_dir, threads_count, delete, ariba_run):
-    ariba_out = Path(ariba_out_dir) / f"outRun_{sra}"
-    report = ariba_out / "report.tsv"
-    if report.exists():
-        logging.info("%s: ARIBA report already exists (%s), skipping ARIBA.", sra, report)
-    else:
-        ok = run_fasterq_dump(sra, out_dir, threads_count)
-        if ok and ariba_run:
-            try:
-                ariba_runner.runAriba(sra, out_dir, ariba_out_dir)
-            except Exception as e:
-                logging.exception("%s: ariba_runner.runAriba raised an exception: %s", sra, e)
-    # cleanup fastq files if present to save space
-    for ext in ("_1.fastq", "_2.fastq"):
-        p = Path(out_dir) / f"{sra}{ext}"
-        if p.exists() and delete:
+def fastq_paths(sra, out_dir):
+    return [Path(out_dir) / f"{sra}{ext}" for ext in FASTQ_EXTS]
+
+
+def fastq_size(sra, out_dir):
+    """Bytes of the fastq files of sra currently in out_dir"""
+    return sum(p.stat().st_size for p in fastq_paths(sra, out_dir) if p.exists())
+
+
+def remove_fastq(sra, out_dir):
+    for p in fastq_paths(sra, out_dir):
+        if p.exists():
             try:
                 p.unlink()
                 logging.info("%s: removed %s", sra, p.name)
@@ -94,29 +124,359 @@ def process_sra(sra, out_dir, ariba_out_dir, threads_count, delete, ariba_run):
                 logging.exception("%s: failed to remove %s", sra, p)
 
 
+class DiskBudget:
+    """
+    Bytes of fastq allowed on disk at once. A download reserves its expected size before it starts
+    and blocks while the budget is used up; the space is given back once ARIBA and Mykrobe are done
+    with the isolate and its fastq files are removed. budget_bytes None means no limit.
+    """
+
+    def __init__(self, budget_bytes=None):
+        self.budget = budget_bytes
+        self.used = 0
+        self._cond = threading.Condition()
+
+    def reserve(self, n):
+        with self._cond:
+            # an isolate larger than the whole budget still runs, alone
+            self._cond.wait_for(lambda: self.budget is None or self.used == 0 or self.used + n <= self.budget)
+            self.used += n
+
+    def adjust(self, reserved, actual):
+        """Replace a reservation by the actual size of the downloaded files"""
+        with self._cond:
+            self.used += actual - reserved
+            self._cond.notify_all()
+
+    def release(self, n):
+        with self._cond:
+            self.used -= n
+            self._cond.notify_all()
+
+
+class SizeEstimate:
+    """Expected fastq size of the next download: the mean size of the downloads so far"""
+
+    def __init__(self, initial_bytes):
+        self.initial = initial_bytes
+        self.total = 0
+        self.count = 0
+        self._lock = threading.Lock()
+
+    def add(self, n):
+        with self._lock:
+            self.total += n
+            self.count += 1
+
+    def get(self):
+        with self._lock:
+            return self.total // self.count if self.count else self.initial
+
+
+class DownloadAribaPipeline:
+    """
+    Staged pipeline: download (fasterq-dump, download_workers at a time) -> ARIBA (ariba_workers at a
+    time) and Mykrobe (mykrobe_workers at a time) side by side on the same reads -> cleanup once both
+    are done. Downloads are held back by the disk budget until the analyses free space, so all
+    stages keep running without filling the disk. Without ARIBA and Mykrobe only the download stage runs.
+    """
+
+    def __init__(self, out_dir, ariba_out_dir, scheduler, download_workers, ariba_workers, delete, ariba_run, budget=None, initial_size=GB,
+                 dump_threads=4, dump_memory=1.0, ariba_threads=2, ariba_memory=2.0, ledger=None, fastq_format="fastq",
+                 target_depth=None, genome_size=GENOME_SIZE, seed=0, ref_dir="out1.card.prepareref",
+                 compact=False, prune=False, mykrobe_run=False, mykrobe_out_dir="mykrobeOut", mykrobe_workers=1,
+                 mykrobe_threads=4, mykrobe_memory=4.0):
+        self.out_dir = out_dir
+        # prepared ARIBA reference, see prepareref_cache.prepared_ref()
+        self.ref_dir = ref_dir
+        # compaction of successful ARIBA runs, see compact_ariba.py
+        self.compact = compact
+        self.prune = prune
+        self.fastq_format = fastq_format
+        # downsampling between download and ARIBA, off if target_depth is None
+        self.target_depth = target_depth
+        self.genome_size = genome_size
+        self.seed = seed
+        self.ledger = ledger
+        self.ariba_out_dir = ariba_out_dir
+        # the worker pools bound the concurrent jobs, the scheduler only starts a job when its threads and memory are free
+        self.scheduler = scheduler
+        self.dump_threads = dump_threads
+        self.dump_memory = dump_memory
+        self.ariba_threads = ariba_threads
+        self.ariba_memory = ariba_memory
+        self.delete = delete
+        self.ariba_run = ariba_run
+        self.mykrobe_run = mykrobe_run
+        self.mykrobe_out_dir = mykrobe_out_dir
+        self.mykrobe_threads = mykrobe_threads
+        self.mykrobe_memory = mykrobe_memory
+        self.budget = DiskBudget(budget)
+        self.estimate = SizeEstimate(initial_size)
+        self.download_pool = ThreadPoolExecutor(max_workers=download_workers)
+        self.ariba_pool = ThreadPoolExecutor(max_workers=ariba_workers)
+        self.mykrobe_pool = ThreadPoolExecutor(max_workers=mykrobe_workers)
+        self._stage_futures = []
+        # analysis stages still running on the reads of each accession, the last one cleans up
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def run(self, sra_list):
+        if self.fastq_format == "fifo":
+            # download and ARIBA run together, as one job
+            futures = [self.ariba_pool.submit(self.stream, sra) for sra in sra_list]
+        else:
+            futures = [self.download_pool.submit(self.download, sra) for sra in sra_list]
+        for fut in as_completed(futures):
+            try:
+                fut.result()
+            except Exception:
+                logging.exception("Downloading a SRA failed")
+        self.download_pool.shutdown()
+        # every ARIBA and Mykrobe job is submitted by now
+        for fut in as_completed(self._stage_futures):
+            try:
+                fut.result()
+            except Exception:
+                logging.exception("Running ARIBA or Mykrobe on a SRA failed")
+        self.ariba_pool.shutdown()
+        self.mykrobe_pool.shutdown()
+
+    def pending_stages(self, sra):
+        """Analysis stages ("ariba", "mykrobe") still to run on sra; those whose output exists are marked done"""
+        outputs = {}
+        if self.ariba_run:
+            outputs["ariba"] = Path(self.ariba_out_dir) / f"outRun_{sra}" / "report.tsv"
+        if self.mykrobe_run:
+            outputs["mykrobe"] = Path(mykrobe_runner.mykrobe_result_path(sra, self.mykrobe_out_dir))
+        stages = []
+        for stage, path in outputs.items():
+            if path.exists():
+                logging.info("%s: %s output already exists (%s), skipping %s.", sra, stage, path, stage)
+                if self.ledger is not None:
+                    self.ledger.mark(sra, stage, DONE)
+            else:
+                stages.append(stage)
+        return stages
+
+    def download(self, sra):
+        stages = self.pending_stages(sra)
+        if (self.ariba_run or self.mykrobe_run) and not stages:
+            if self.delete:
+                remove_fastq(sra, self.out_dir)
+            return
+        reserved = self.estimate.get()
+        self.budget.reserve(reserved)
+        logging.info("%s: reserved %.2f GB of the disk budget (%.2f GB in use)", sra, reserved / GB, self.budget.used / GB)
+        try:
+            ok = run_fasterq_dump(
+                sra, self.out_dir, self.dump_threads, scheduler=self.scheduler, memory=self.dump_memory, ledger=self.ledger, fastq_format=self.fastq_format
+            )
+        except Exception:
+            self.budget.release(reserved)
+            raise
+        size = fastq_size(sra, self.out_dir)
+        if ok:
+            self.estimate.add(size)
+        if ok and self.target_depth is not None:
+            ok = self.subsample(sra)
+            size = fastq_size(sra, self.out_dir)
+        self.budget.adjust(reserved, size)
+        if ok and stages:
+            # ARIBA and Mykrobe read the same files, they are removed when the last one is done
+            pools = {"ariba": (self.ariba_pool, self.ariba), "mykrobe": (self.mykrobe_pool, self.mykrobe)}
+            with self._lock:
+                self._pending[sra] = len(stages)
+                for stage in stages:
+                    pool, job = pools[stage]
+                    self._stage_futures.append(pool.submit(job, sra, size))
+        else:
+            if self.ledger is not None:
+                for stage in stages:
+                    # so that --only-failed picks the accession up again
+                    self.ledger.mark(sra, stage, FAILED, error="download failed")
+            self.cleanup(sra, size)
+
+    def subsample(self, sra):
+        """Downsample the reads of sra to the target depth, recorded as stage "subsample" with the depth before and after"""
+        reads1, reads2 = fastq_stream.read_paths(sra, self.out_dir, self.fastq_format)
+        if self.ledger is not None:
+            self.ledger.start(sra, "subsample")
+        try:
+            with reserve(self.scheduler, "subsample", 1):
+                stats = subsample_to_depth(reads1, reads2, self.target_depth, self.genome_size, self.seed)
+        except Exception as e:
+            logging.exception("%s: subsampling the reads failed", sra)
+            if self.ledger is not None:
+                self.ledger.finish(sra, "subsample", None, error=str(e))
+            return False
+        logging.info("%s: depth %.1fx -> %.1fx (%d of %d read pairs kept)", sra, stats["depth"], stats["depth_after"], stats["kept_pairs"], stats["pairs"])
+        if self.ledger is not None:
+            self.ledger.finish(sra, "subsample", 0, **stats)
+        return True
+
+    def ariba(self, sra, size):
+        try:
+            ariba_runner.runAriba(sra, self.out_dir, self.ariba_out_dir, False, self.ariba_threads, self.scheduler, self.ariba_memory, self.ledger, self.ref_dir, self.compact, self.prune)
+        except Exception as e:
+            logging.exception("%s: ariba_runner.runAriba raised an exception: %s", sra, e)
+        finally:
+            self.stage_done(sra, size)
+
+    def mykrobe(self, sra, size):
+        try:
+            exit_code = mykrobe_runner.runMykrobe(
+                sra, self.ledger, self.out_dir, self.mykrobe_out_dir, self.mykrobe_threads, self.scheduler, self.mykrobe_memory
+            )
+            if exit_code != 0:
+                logging.error("%s: mykrobe predict failed (exit code %s)", sra, exit_code)
+        except Exception as e:
+            logging.exception("%s: mykrobe_runner.runMykrobe raised an exception: %s", sra, e)
+        finally:
+            self.stage_done(sra, size)
+
+    def stage_done(self, sra, size):
+        """Clean up after the last analysis stage running on the reads of sra"""
+        with self._lock:
+            self._pending[sra] -= 1
+            last = self._pending[sra] == 0
+            if last:
+                del self._pending[sra]
+        if last:
+            self.cleanup(sra, size)
+
+    def stream(self, sra):
+        """
+        Stream the reads of sra from fasterq-dump to ARIBA through named pipes. Both tools run at the
+        same time, so they reserve their threads and memory together.
+        """
+        report = Path(self.ariba_out_dir) / f"outRun_{sra}" / "report.tsv"
+        if report.exists():
+            logging.info("%s: ARIBA report already exists (%s), skipping ARIBA.", sra, report)
+            if self.ledger is not None:
+                self.ledger.mark(sra, "ariba", DONE)
+            return
+        Path(self.out_dir).mkdir(parents=True, exist_ok=True)
+        reads1, reads2 = fastq_stream.read_paths(sra, self.out_dir, "fifo")
+        with reserve(self.scheduler, "fasterq-dump+ariba", self.dump_threads + self.ariba_threads, self.dump_memory + self.ariba_memory):
+            fastq_stream.make_fifos(reads1, reads2)
+            result = {}
+
+            def produce():
+                result["exit_code"] = fastq_stream.stream_reads(sra, reads1, reads2, self.dump_threads)
+
+            if self.ledger is not None:
+                self.ledger.start(sra, "download")
+            producer = threading.Thread(target=produce, daemon=True)
+            producer.start()
+            try:
+                ariba_runner.runAriba(sra, self.out_dir, self.ariba_out_dir, False, self.ariba_threads, None, self.ariba_memory, self.ledger, self.ref_dir, self.compact, self.prune)
+            except Exception as e:
+                logging.exception("%s: ariba_runner.runAriba raised an exception: %s", sra, e)
+            finally:
+                # unblock the producer if ARIBA stopped reading early or never opened the pipes
+                while producer.is_alive():
+                    fastq_stream.release_fifos(reads1, reads2)
+                    producer.join(1)
+                fastq_stream.remove_fifos(reads1, reads2)
+        exit_code = result.get("exit_code")
+        if self.ledger is not None:
+            self.ledger.finish(sra, "download", exit_code, streamed=True)
+        if exit_code != 0:
+            logging.error("%s: streaming the reads from fasterq-dump failed (exit code %s)", sra, exit_code)
+
+    def cleanup(self, sra, size):
+        """Remove the fastq files if requested and give their space back to the budget"""
+        if self.delete:
+            remove_fastq(sra, self.out_dir)
+        if self.delete or self.budget.budget is None:
+            self.budget.release(size)
+        else:
+            # kept files stay on disk and keep their share of the budget
+            self.budget.adjust(size, fastq_size(sra, self.out_dir))
+
+
 def main():
-    parser = ArgumentParser(prog="fasterq_download.py", description="Download FASTQ for SRAs and run ARIBA.")
+    parser = ArgumentParser(prog="fasterq_download.py", description="Download FASTQ for SRAs and run ARIBA and Mykrobe.")
     parser.add_argument("-f", "--fSRAs", required=True, help="SRA list (json list or newline file)")
     parser.add_argument("-o", "--oDir", required=True, help="Directory to write fastq (temporary)")
     parser.add_argument("-a", "--ariba_out", default="aribaResult_withBam", help="ARIBA output directory")
-    parser.add_argument("-t", "--threads", type=int, default=max(1, psutil.cpu_count() - 2), help="Threads per fasterq-dump")
-    parser.add_argument("-w", "--workers", type=int, default=4, help="Concurrent SRAs to process")
+    parser.add_argument("-t", "--threads", type=int, default=4, help="Threads per fasterq-dump (default: 4)")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="Max concurrent SRA downloads (default: cores / threads)")
+    parser.add_argument("--ariba_threads", type=int, default=2, help="Threads per ARIBA run (default: 2)")
+    parser.add_argument("--ariba_workers", type=int, default=None, help="Max concurrent ARIBA runs (default: cores / ariba_threads)")
+    parser.add_argument("--dump_memory", type=float, default=1.0, help="GB of memory reserved per fasterq-dump (default: 1.0)")
+    parser.add_argument("--ariba_memory", type=float, default=2.0, help="GB of memory reserved per ARIBA run (default: 2.0)")
+    parser.add_argument("--cores", type=int, default=psutil.cpu_count(), help="Cores shared by downloads, ARIBA and Mykrobe runs (default: all cores)")
+    parser.add_argument("--memory", type=float, default=None, help="GB of memory shared by downloads, ARIBA and Mykrobe runs (default: 90%% of RAM)")
     parser.add_argument("--delete", action="store_true", help="Delete downloaded files after processing (default: False)")
     parser.add_argument("--ariba_run", action="store_true", help="Run ariba after isotope download (default: False)")
-
+    parser.add_argument("--mykrobe_run", action="store_true", help="Run mykrobe predict on the downloaded reads, next to ARIBA (default: False)")
+    parser.add_argument("--mykrobe_out", default="mykrobeOut", help="Mykrobe output directory (default: mykrobeOut)")
+    parser.add_argument("--mykrobe_threads", type=int, default=4, help="Threads per Mykrobe run (default: 4)")
+    parser.add_argument("--mykrobe_workers", type=int, default=None, help="Max concurrent Mykrobe runs (default: cores / mykrobe_threads)")
+    parser.add_argument("--mykrobe_memory", type=float, default=4.0, help="GB of memory reserved per Mykrobe run (default: 4.0)")
+    parser.add_argument("--disk_budget", type=float, default=None,
+                        help="Max GB of fastq on disk at once; downloads wait until ARIBA/Mykrobe free space (requires --ariba_run or --mykrobe_run, and --delete)")
+    parser.add_argument("--fastq_size", type=float, default=1.0, help="Expected GB of fastq per SRA until the first downloads are done (default: 1.0)")
+    parser.add_argument("--fastq_format", choices=fastq_stream.FASTQ_FORMATS, default="fastq",
+                        help="fastq: plain fastq files; gz: reads compressed on the fly (pigz/gzip) into .fastq.gz, read by ARIBA as they are; "
+                        "fifo: reads streamed to ARIBA through named pipes, never written to disk (requires --ariba_run)")
+    parser.add_argument("--target_depth", type=float, default=None,
+                        help="Downsample the read pairs of deeper isolates to about this depth before ARIBA, e.g. 100 (default: no downsampling)")
+    parser.add_argument("--genome_size", type=int, default=GENOME_SIZE, help=f"Genome size in bp to estimate the depth (default: {GENOME_SIZE}, H37Rv)")
+    parser.add_argument("--seed", type=int, default=0, help="Random seed of the downsampling (default: 0)")
+    parser.add_argument("--compact", action="store_true", help="Compact each successful ARIBA run to report.tsv + compact.npz (match flags, variant read depth windows)")
+    parser.add_argument("--prune", action="store_true", help="With --compact, delete the rest of the ARIBA run directory (BAMs, assemblies, ...)")
+    add_ref_args(parser)
+    add_ledger_args(parser)
 
     args = parser.parse_args()
+    if (args.compact or args.prune) and not args.ariba_run:
+        parser.error("--compact and --prune require --ariba_run")
+    if args.prune and not args.compact:
+        parser.error("--prune requires --compact")
+    if args.disk_budget is not None and not ((args.ariba_run or args.mykrobe_run) and args.delete):
+        parser.error("--disk_budget requires --ariba_run or --mykrobe_run, and --delete, otherwise no space is ever freed")
+    if args.fastq_format == "fifo" and not args.ariba_run:
+        parser.error("--fastq_format fifo requires --ariba_run, the named pipes need a reader")
+    if args.fastq_format == "fifo" and args.target_depth is not None:
+        parser.error("--target_depth needs the reads on disk to count them first, it does not work with --fastq_format fifo")
+    if args.fastq_format == "fifo" and args.mykrobe_run:
+        parser.error("--mykrobe_run needs the reads on disk, the named pipes can only be read once (by ARIBA)")
 
     sra_list = load_sra_list(args.fSRAs)
     logging.info("Loaded %d SRA accessions", len(sra_list))
+    # accessions recorded as done for every last stage that is run (ARIBA, Mykrobe or the download) are skipped
+    ledger = JobLedger(args.ledger)
+    stages = [stage for stage, run in (("ariba", args.ariba_run), ("mykrobe", args.mykrobe_run)) if run] or ["download"]
+    selected = set()
+    for stage in stages:
+        selected.update(ledger.select(sra_list, stage, args.only_failed, args.only_pending))
+    sra_list = [sra for sra in sra_list if sra in selected]
+    logging.info("%d accessions to process", len(sra_list))
 
-    with ThreadPoolExecutor(max_workers=args.workers) as exe:
-        futures = [exe.submit(process_sra, sra, args.oDir, args.ariba_out, args.threads, args.delete, args.ariba_run) for sra in sra_list]
-        for fut in as_completed(futures):
-            try:
-                fut.result()
-            except Exception:
-                logging.exception("Processing a SRA failed")
+    # built once (or found in the cache) before any ARIBA run
+    ref_dir = resolve_ref(args) if args.ariba_run else None
+    if ref_dir is not None:
+        logging.info("Prepared reference: %s", ref_dir)
+
+    scheduler = ResourceScheduler(args.cores, args.memory)
+    workers = args.workers or max(1, scheduler.cores // args.threads)
+    ariba_workers = args.ariba_workers or max(1, scheduler.cores // args.ariba_threads)
+    mykrobe_workers = args.mykrobe_workers or max(1, scheduler.cores // args.mykrobe_threads)
+    budget = None if args.disk_budget is None else int(args.disk_budget * GB)
+    pipeline = DownloadAribaPipeline(
+        args.oDir, args.ariba_out, scheduler, workers, ariba_workers, args.delete, args.ariba_run, budget, int(args.fastq_size * GB),
+        args.threads, args.dump_memory, args.ariba_threads, args.ariba_memory, ledger, args.fastq_format,
+        args.target_depth, args.genome_size, args.seed, ref_dir, args.compact, args.prune,
+        args.mykrobe_run, args.mykrobe_out, mykrobe_workers, args.mykrobe_threads, args.mykrobe_memory,
+    )
+    pipeline.run(sra_list)
+    scheduler.log_summary()
+    for stage in stages:
+        logging.info("%s jobs: %s", stage, ledger.summary(stage))
+    ledger.close()
 
 
 if __name__ == "__main__":
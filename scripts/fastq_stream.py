@@ -0,0 +1,213 @@
+"""
+Hand-off of the reads of fasterq-dump to ARIBA without plain fastq files on disk.
+`fasterq-dump --split-spot --stdout` writes both mates of every spot one after the other; the
+stream is split into the two mates and written
+  - gzip-compressed (pigz, or gzip if pigz is not installed) to <sra>_1.fastq.gz and
+    <sra>_2.fastq.gz, which ARIBA and Mykrobe read directly, or
+  - to the named pipes <sra>_1.fastq and <sra>_2.fastq, which ARIBA reads while fasterq-dump
+    is running, so the reads never land on disk.
+zstd is not offered: ARIBA reads fastq through zlib and cannot read it.
+"""
+
+import os
+import queue
+import shutil
+import subprocess
+import threading
+
+FASTQ_FORMATS = ("fastq", "gz", "fifo")
+# suffix of the compressed mates while they are written, renamed once the stream is complete
+PART_SUFFIX = ".part"
+# records written to a mate at a time
+BATCH_RECORDS = 4096
+# batches buffered per mate, so the mates can be consumed at a different pace
+QUEUE_BATCHES = 64
+
+
+def read_paths(sra, fastq_dir, fastq_format="fastq"):
+    """Paths of the read pair of sra written in fastq_format"""
+    ext = ".fastq.gz" if fastq_format == "gz" else ".fastq"
+    return (
+        os.path.join(fastq_dir, f"{sra}_1{ext}"),
+        os.path.join(fastq_dir, f"{sra}_2{ext}"),
+    )
+
+
+def find_reads(sra, fastq_dir):
+    """Paths of the read pair of sra in fastq_dir (plain, gzip or named pipes), None if missing"""
+    for fastq_format in ("fastq", "gz"):
+        reads1, reads2 = read_paths(sra, fastq_dir, fastq_format)
+        # os.path.exists() and not isfile(), which is False for named pipes
+        if os.path.exists(reads1) and os.path.exists(reads2):
+            return reads1, reads2
+    return None
+
+
+def compressor_cmd(threads=1):
+    """Command compressing stdin to stdout with gzip, in parallel if pigz is installed"""
+    if shutil.which("pigz"):
+        return ["pigz", "-c", "-p", str(threads)]
+    return ["gzip", "-c"]
+
+
+def _spot_name(header):
+    name = header.split(None, 1)[0]
+    # mates named <spot>/1 and <spot>/2 by some deflines
+    if name[-2:] in (b"/1", b"/2"):
+        name = name[:-2]
+    return name
+
+
+def fastq_records(stream):
+    """Yield the fastq records (lists of 4 lines) of a binary stream"""
+    while True:
+        record = [stream.readline() for _ in range(4)]
+        if not record[3]:
+            return
+        yield record
+
+
+def split_mates(stream, put1, put2):
+    """
+    Split the fastq records of stream (both mates of a spot in a row) into mates, passing batches
+    of bytes to put1 and put2. Spots without a mate are dropped, as fasterq-dump --split-3 would
+    write them to <sra>.fastq. Return the number of pairs.
+    """
+    batch1, batch2 = [], []
+    n_pairs = 0
+    prev_name, prev = None, None
+    for record in fastq_records(stream):
+        name = _spot_name(record[0])
+        if prev is not None and name == prev_name:
+            batch1.extend(prev)
+            batch2.extend(record)
+            n_pairs += 1
+            prev_name, prev = None, None
+            if n_pairs % BATCH_RECORDS == 0:
+                put1(b"".join(batch1))
+                put2(b"".join(batch2))
+                batch1, batch2 = [], []
+        else:
+            prev_name, prev = name, record
+    if batch1:
+        put1(b"".join(batch1))
+        put2(b"".join(batch2))
+    return n_pairs
+
+
+class _MateWriter(threading.Thread):
+    """Write the batches of one mate from a queue, so a slow reader of one mate does not block the other"""
+
+    def __init__(self, open_sink):
+        super().__init__(daemon=True)
+        self.open_sink = open_sink
+        self.queue = queue.Queue(maxsize=QUEUE_BATCHES)
+        self.error = None
+
+    def put(self, data):
+        if self.error is not None:
+            raise self.error
+        self.queue.put(data)
+
+    def run(self):
+        try:
+            with self.open_sink() as sink:
+                while True:
+                    data = self.queue.get()
+                    if data is None:
+                        break
+                    sink.write(data)
+        except (BrokenPipeError, OSError) as e:
+            self.error = e
+            # keep draining so the splitter is not blocked
+            while self.queue.get() is not None:
+                pass
+
+
+def stream_reads(sra, reads1, reads2, threads=1, compress=False):
+    """
+    Run fasterq-dump --split-spot --stdout for sra and write the mates to reads1 and reads2,
+    gzip-compressed if compress (regular files) or as they are (e.g. named pipes opened by the
+    reader). Return the exit code of fasterq-dump, or of the first failed compressor / writer.
+    Compressed mates are written to <reads>.part and only renamed to reads1 and reads2 when
+    everything succeeded, so a failed or killed stream never leaves truncated files behind.
+    """
+    if not compress:
+        return _stream_reads(sra, reads1, reads2, threads, compress)
+    parts = [reads1 + PART_SUFFIX, reads2 + PART_SUFFIX]
+    exit_code = 1
+    try:
+        exit_code = _stream_reads(sra, parts[0], parts[1], threads, compress)
+    finally:
+        if exit_code == 0:
+            os.replace(parts[0], reads1)
+            os.replace(parts[1], reads2)
+        else:
+            for path in parts:
+                if os.path.exists(path):
+                    os.unlink(path)
+    return exit_code
+
+
+def _stream_reads(sra, reads1, reads2, threads=1, compress=False):
+    """stream_reads() writing to reads1 and reads2 directly"""
+    dump = subprocess.Popen(
+        ["fasterq-dump", sra, "--split-spot", "--stdout", "--threads", str(threads)],
+        stdout=subprocess.PIPE,
+    )
+    compressors = []
+    if compress:
+        for path in (reads1, reads2):
+            with open(path, "wb") as f:
+                compressors.append(
+                    subprocess.Popen(
+                        compressor_cmd(threads), stdin=subprocess.PIPE, stdout=f
+                    )
+                )
+        writers = [_MateWriter(lambda c=c: c.stdin) for c in compressors]
+    else:
+        writers = [_MateWriter(lambda p=p: open(p, "wb")) for p in (reads1, reads2)]
+    for w in writers:
+        w.start()
+    try:
+        split_mates(dump.stdout, writers[0].put, writers[1].put)
+    except OSError:
+        # a reader went away, stop fasterq-dump
+        dump.kill()
+    finally:
+        for w in writers:
+            w.queue.put(None)
+        for w in writers:
+            w.join()
+        dump.stdout.close()
+    exit_code = dump.wait()
+    for c in compressors:
+        exit_code = exit_code or c.wait()
+    if exit_code == 0 and any(w.error is not None for w in writers):
+        exit_code = 1
+    return exit_code
+
+
+def make_fifos(reads1, reads2):
+    for path in (reads1, reads2):
+        if os.path.exists(path):
+            os.unlink(path)
+        os.mkfifo(path)
+
+
+def release_fifos(reads1, reads2):
+    """
+    Open the pipes for reading once, so a writer still waiting for a reader (e.g. when ARIBA
+    did not run) gets through and fails with a broken pipe
+    """
+    for path in (reads1, reads2):
+        try:
+            os.close(os.open(path, os.O_RDONLY | os.O_NONBLOCK))
+        except OSError:
+            pass
+
+
+def remove_fifos(reads1, reads2):
+    for path in (reads1, reads2):
+        if os.path.exists(path):
+            os.unlink(path)
@@ -0,0 +1,109 @@
+"""
+Binary format of the training data of one drug, written by get_feature_vector.py:
+  featureM_X_<drug>.npy       bit-packed 0/1 feature matrix (isolate x feature), can be memory-mapped
+  featureM_X_<drug>.meta.npz  labels, SRA accessions and feature names of the matrix
+load_dataset() is the single loader used by the training and prediction scripts. It falls back
+to the text files (featureM_X_<drug>.txt, label_Y_<drug>.txt, sra_withFeature_<drug>.txt and
+raw_fList.txt) when no binary dataset is found.
+"""
+
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+from packed_matrix import PackedBinaryMatrix
+
+FEATURE_PREFIX = "featureM_X_"
+LABEL_PREFIX = "label_Y_"
+SRA_PREFIX = "sra_withFeature_"
+FEATURE_LIST = "raw_fList.txt"
+
+
+def dataset_paths(drug, prefix=FEATURE_PREFIX):
+    """Paths of the matrix (.npy) and metadata (.meta.npz) files of the dataset of drug"""
+    return prefix + drug + ".npy", prefix + drug + ".meta.npz"
+
+
+def save_dataset(drug, X, y, sra_list, feature_names, prefix=FEATURE_PREFIX):
+    """
+    Save the 0/1 feature matrix X (dense, scipy.sparse or PackedBinaryMatrix) bit-packed, with
+    labels y, SRA accessions of the rows and feature names of the columns
+    """
+    if sp.issparse(X):
+        X = PackedBinaryMatrix.from_csr(X)
+    elif not isinstance(X, PackedBinaryMatrix):
+        X = PackedBinaryMatrix.from_dense(X)
+    if X.shape != (len(y), len(feature_names)) or len(sra_list) != len(y):
+        raise ValueError(
+            "Inconsistent dataset for {}: X {}, {} labels, {} SRAs, {} features".format(
+                drug, X.shape, len(y), len(sra_list), len(feature_names)
+            )
+        )
+    npy_path, meta_path = dataset_paths(drug, prefix)
+    np.save(npy_path, X.bits)
+    with open(meta_path, "wb") as f:
+        np.savez(
+            f,
+            n_features=X.n_features,
+            labels=np.asarray(y),
+            sra=np.array(sra_list, dtype=str),
+            features=np.array(feature_names, dtype=str),
+        )
+
+
+def _read_lines(path):
+    with open(path) as f:
+        return [line.rstrip("\n") for line in f if line.strip()]
+
+
+def load_dataset(
+    drug,
+    prefix=FEATURE_PREFIX,
+    mmap_mode="r",
+    feature_list=FEATURE_LIST,
+    packed=False,
+    sparse=False,
+):
+    """
+    Load the dataset of drug and return (X, y, sra_list, feature_names).
+    X is a dense int8 matrix unpacked chunk by chunk, a scipy.sparse CSR matrix when sparse is True,
+    or the PackedBinaryMatrix itself when packed is True, whose packed bits are memory-mapped unless
+    mmap_mode is None. For text datasets the
+    labels and accessions are read from the files named like the feature matrix, and sra_list or
+    feature_names are None when their file does not exist.
+    """
+    npy_path, meta_path = dataset_paths(drug, prefix)
+    if os.path.isfile(npy_path):
+        X = np.load(npy_path, mmap_mode=mmap_mode)
+        with np.load(meta_path) as meta:
+            y = meta["labels"]
+            sra_list = meta["sra"].tolist()
+            feature_names = meta["features"].tolist()
+            if "n_features" in meta:
+                X = PackedBinaryMatrix(X, int(meta["n_features"]))
+            else:
+                # datasets saved before bit-packing hold the dense matrix
+                X = PackedBinaryMatrix.from_dense(X)
+        return _unpack(X, packed, sparse), y, sra_list, feature_names
+
+    X = np.loadtxt(prefix + drug + ".txt", dtype="i4", ndmin=2)
+    if packed:
+        X = PackedBinaryMatrix.from_dense(X)
+    elif sparse:
+        X = sp.csr_matrix(X)
+    y = np.loadtxt(
+        prefix.replace(FEATURE_PREFIX, LABEL_PREFIX) + drug + ".txt", dtype="i4"
+    )
+    sra_path = SRA_PREFIX + drug + ".txt"
+    sra_list = _read_lines(sra_path) if os.path.isfile(sra_path) else None
+    feature_names = _read_lines(feature_list) if os.path.isfile(feature_list) else None
+    return X, y, sra_list, feature_names
+
+
+def _unpack(X, packed, sparse):
+    if packed:
+        return X
+    if sparse:
+        return X.tocsr()
+    return X.toarray()
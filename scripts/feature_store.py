@@ -0,0 +1,101 @@
+"""
+Persistent store of the genetic features parsed from the ariba output of every isolate, so that
+get_feature_vector.py only has to parse isolates that are new or whose report/summary changed.
+Isolates are keyed by SRA accession and the size/mtime of their report and summary files, with
+a content hash to tell a touched file from a changed one. Fixed features (the lineages) take
+the first columns of the vocabulary; detected features are appended after them.
+cohort_rows() gives the columns of a cohort exactly as a store rebuilt from that cohort has them,
+so an incremental update and a rebuild write the same feature list and matrices.
+"""
+
+import os
+
+import numpy as np
+
+from feature_vocabulary import FeatureVocabulary
+from signed_files import SignedFiles
+
+STORE_PATH = "feature_store.npz"
+
+
+class FeatureStore(object):
+    """Feature IDs of every parsed isolate plus the signature of the files they came from"""
+
+    def __init__(self, fixed_features=()):
+        self.fixed = list(fixed_features)
+        self.vocab = FeatureVocabulary(self.fixed)
+        self.rows = {}
+        # report and summary file of every isolate
+        self.files = SignedFiles(2)
+
+    def __len__(self):
+        return len(self.rows)
+
+    def is_current(self, sra, summary_path, report_path):
+        """
+        True if the stored features of sra were parsed from the current report and summary.
+        Files whose mtime changed but not their content are re-signed without parsing.
+        """
+        return sra in self.rows and self.files.is_current(
+            sra, report_path, summary_path
+        )
+
+    def put(self, sra, features, summary_path, report_path):
+        """Store the features (names) parsed from the report and summary of sra"""
+        self.rows[sra] = self.vocab.update(features)
+        self.files.sign(sra, report_path, summary_path)
+
+    def get_rows(self, sra_list):
+        """Feature IDs of the isolates in sra_list as sparse rows (indptr, indices)"""
+        rows = [self.rows[sra] for sra in sra_list]
+        indptr = np.zeros(len(rows) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(r) for r in rows])
+        indices = np.concatenate(rows) if rows else np.zeros(0, dtype=np.int64)
+        return indptr, indices
+
+    def cohort_rows(self, sra_list):
+        """
+        Vocabulary and sparse rows (indptr, indices) of the isolates in sra_list with the columns a
+        store built from sra_list alone has: the fixed features at their positions, then the features
+        in the order they first appear in the rows. Features no isolate of sra_list has (any more)
+        are left out. Columns only move when isolates before them change or are removed.
+        """
+        indptr, indices = self.get_rows(sra_list)
+        vocab = FeatureVocabulary(self.fixed)
+        ids, first = np.unique(indices, return_index=True)
+        ordered = ids[np.argsort(first)]
+        remap = np.full(len(self.vocab), -1, dtype=np.int64)
+        remap[ordered] = vocab.update([self.vocab.names[k] for k in ordered])
+        return vocab, indptr, remap[indices]
+
+    def save(self, path=STORE_PATH):
+        accessions = list(self.rows)
+        indptr, indices = self.get_rows(accessions)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                features=np.array(self.vocab.names, dtype=str),
+                fixed=np.array(self.fixed, dtype=str),
+                accessions=np.array(accessions, dtype=str),
+                indptr=indptr,
+                indices=indices,
+                **self.files.arrays(accessions),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=STORE_PATH):
+        store = cls()
+        with np.load(path) as data:
+            store.vocab = FeatureVocabulary(data["features"].tolist())
+            # stores written before the fixed features had none
+            if "fixed" in data:
+                store.fixed = data["fixed"].tolist()
+            indptr = data["indptr"]
+            indices = data["indices"]
+            accessions = data["accessions"].tolist()
+            for i, sra in enumerate(accessions):
+                store.rows[sra] = indices[indptr[i] : indptr[i + 1]]
+            store.files.load_arrays(accessions, data)
+        return store
@@ -0,0 +1,74 @@
+"""
+Insertion-ordered vocabulary of feature names. The integer ID of a feature is its column index
+in the feature matrices, so names can be mapped to columns without scanning the feature list.
+"""
+
+import json
+
+import numpy as np
+
+# saved next to raw_fList.txt by get_feature_vector.py
+VOCAB_PATH = "raw_fList.vocab.json"
+
+
+def model_vocab_path(drug):
+    """Vocabulary of the columns the models of drug were trained on, saved next to the models"""
+    return "features_" + drug + ".vocab.json"
+
+
+class FeatureVocabulary(object):
+    """Feature names in insertion order with O(1) membership test and name -> ID lookup"""
+
+    def __init__(self, names=()):
+        self.names = []
+        self._index = {}
+        self.update(names)
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self._index
+
+    def __iter__(self):
+        return iter(self.names)
+
+    def add(self, name):
+        """Add name if it is new and return its ID"""
+        i = self._index.get(name)
+        if i is None:
+            i = len(self.names)
+            self._index[name] = i
+            self.names.append(name)
+        return i
+
+    def update(self, names):
+        """Add every name in names and return their IDs"""
+        return np.array([self.add(x) for x in names], dtype=np.int64)
+
+    def index(self, name):
+        """ID of name, raise KeyError if it is not in the vocabulary"""
+        return self._index[name]
+
+    def indices(self, names, skip_unknown=False):
+        """IDs of names. Unknown names raise KeyError, or are left out when skip_unknown is True"""
+        if skip_unknown:
+            return np.array(
+                [self._index[x] for x in names if x in self._index], dtype=np.int64
+            )
+        return np.array([self._index[x] for x in names], dtype=np.int64)
+
+    def save(self, path=VOCAB_PATH):
+        with open(path, "w") as f:
+            json.dump({"features": self.names}, f)
+
+    @classmethod
+    def load(cls, path=VOCAB_PATH):
+        with open(path) as f:
+            return cls(json.load(f)["features"])
+
+    @classmethod
+    def from_list_file(cls, path):
+        """Build the vocabulary from a feature list with one name per line, e.g. raw_fList.txt"""
+        with open(path) as f:
+            return cls(line.rstrip("\n") for line in f if line.strip())
@@ -20,6 +20,10 @@ from tensorflow.keras.layers import (
 )
 from tensorflow.keras.models import Model
 import random
+from ariba_report import read_report, variant_ids
+from feature_vocabulary import FeatureVocabulary
+from feature_dataset import load_dataset
+from compact_ariba import read_depth_table
 
 # from scipy import stats
 
@@ -431,9 +435,6 @@ _ALLOWED_BASES = ["A", "C", "G", "T"]
 _MIN_COV = 1
 _MAX_COV = 856
 firstLine_TB_4antibio = ["rifampicin", "ethambutol", "isoniazid", "pyrazinamide"]
-ext = ".txt"
-pre_sra_path = "sra_withFeature_"
-pre_label_path = "label_Y_"
 pre_feature_path = "featureM_X_"
 
 
@@ -445,24 +446,25 @@ def generate_multiInputsNlabels4CNN(hparams, drug):
     X = []
     Y = []
 
-    # The orders in sra_list_file,label_file and feature_file correspond, which were generated for traditional machine learning.
-    text = open("".join([pre_sra_path, drug, ext])).read()
-    text = text.rstrip()
-    sra_list = text.split("\n")
+    # The orders of SRAs, labels and feature matrix rows correspond, which were generated for traditional machine learning.
+    # The feature names are the ones stored with the dataset; hparams.feature_id_path is only read
+    # for text datasets, which are saved without them.
+    f_values, labels, sra_list, feature_names = load_dataset(
+        drug, prefix=pre_feature_path, feature_list=hparams.feature_id_path
+    )
+    labels = labels.tolist()
+    if feature_names is None or len(feature_names) != f_values.shape[1]:
+        raise ValueError(
+            "No feature names for the {} columns of the {} feature matrix".format(
+                f_values.shape[1], drug
+            )
+        )
 
-    text = open("".join([pre_label_path, drug, ext])).read()
-    text = text.rstrip()
-    labels = text.split("\n")
-    labels = list(map(int, labels))
+    # feature name -> column index of the feature matrix
+    vocab = FeatureVocabulary(feature_names)
 
-    text = open(hparams.feature_id_path).read()
-    text = text.rstrip()
-    f_ID = text.split("\n")
-
-    df = pd.read_csv(
-        "".join([pre_feature_path, drug, ext]), header=None, sep="\s+", dtype=int
-    )
-    df.columns = f_ID
+    df = pd.DataFrame(f_values, columns=vocab.names)
+    oneD_cols = vocab.indices(hparams.lineageNgenePresent[drug])
 
     l_oneD = len(hparams.lineageNgenePresent[drug])
     l_var = len(hparams.variants[drug])
@@ -472,16 +474,14 @@ def generate_multiInputsNlabels4CNN(hparams, drug):
         if not (os.path.isfile(report_path)):
             f.write("Report file for {} does not exist".format(sra))
         else:
-            report_df = pd.read_csv(report_path, sep="\t")
+            report_df = read_report(report_path)
             var_input_fromOneSample = generate_var_inputFromOneIsolate(
                 i, df, report_df, sra, hparams, drug
             )
 
             # prepare lineage and gene present input
             oneD_feature = np.zeros((1, l_oneD))
-            for j, fea in enumerate(hparams.lineageNgenePresent[drug]):
-                if df.loc[i, fea] == 1:
-                    oneD_feature[0, j] = 1
+            oneD_feature[0, f_values[i, oneD_cols] == 1] = 1
 
             # prepare variant input
             Y.append(labels[i])
@@ -503,15 +503,9 @@ def generate_var_inputFromOneIsolate(i, df, report_df, sra, hparams, drug):
     So, report_df['ref_name'][i]+'.'+report_df['ref_ctg_change'][i] is how variant ID is composed.
     Create on more column to save the variant IDs"""
     var_input_singleSample = []
-    var_join = []
 
     # Add one additional row of variant IDs to report_df.
-    for i_r, r in report_df.iterrows():
-        if r["known_var"] == "1" and r["has_known_var"] == "1":
-            var_join.append(r["ref_name"] + "." + r["known_var_change"])
-        else:
-            var_join.append(r["ref_name"] + "." + r["ref_ctg_change"])
-    report_df["var_ID"] = var_join
+    report_df["var_ID"] = variant_ids(report_df)
 
     for var in hparams.variants[drug]:
         # generate a normalized count matrix (21x4) for one variant of one sample
@@ -533,15 +527,8 @@ def generate_var_inputFromOneIsolate(i, df, report_df, sra, hparams, drug):
             # obtain var locus in that contig
             v_locus = int(report_df.loc[v_index, "ctg_start"])
 
-            depth_path = (
-                hparams.ariba_result_dir
-                + "/outRun_"
-                + sra
-                + "/clusters/"
-                + cluster
-                + "/assembly.reads_mapped.bam.read_depths.gz"
-            )
-            df_depth = pd.read_csv(depth_path, header=None, sep="\t")
+            # from the cluster directory, or the windows kept by compact_ariba.py
+            df_depth = read_depth_table(hparams.ariba_result_dir, sra, cluster)
             df_depth.columns = ["ctg", "loc", "ctg_base", "alt", "t_read", "c_4base"]
             df_depth["loc"] = df_depth["loc"].astype(int)
             df_depth = df_depth[df_depth["ctg_base"].isin(_ALLOWED_BASES)]
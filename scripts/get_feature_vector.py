@@ -4,12 +4,16 @@ evaluation and testing ML models for the 4 first-line TB drug resistance predict
 """
 
 import numpy as np
-import csv
 import os
 import pandas as pd
-from pandas import ExcelWriter
-from pandas import ExcelFile
-import json
+import scipy.sparse as sp
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from ariba_report import parse_report_features, feature_vector
+from feature_vocabulary import FeatureVocabulary, VOCAB_PATH
+from feature_store import FeatureStore, STORE_PATH
+from feature_dataset import save_dataset
+from metadata_cache import load_metadata, MISSING_LABEL, NO_LINEAGE
 
 lineage = [
     "LAM",
@@ -48,203 +52,284 @@ def loadAccessions():
     return sra_list
 
 
-def get_variable_names():
+def ariba_output_paths(sra, native_match=False):
     """
-    Select AMR associated know variants and gene presents, and novel variants that on coding regions  into
-    feature vector for training and testing ML models,which are detected from at least one isolate
-    """
-    sra_list = loadAccessions()
-    n_sra = len(sra_list)
-    raw_feature = []
-
-    for j in range(0, n_sra):
-        sra = sra_list[j]
-        # summary and report files are outputs of ariba, containing reference clusters that are matched by the sample
-        # and information about the called variants and detected AMR associated genes respectively
-        summary = "summary_output_full/" + sra + "_summary.csv"
-        ariba_output = "aribaResult_withBam/outRun_" + sra + "/report.tsv"
+    summary and report files are outputs of ariba, containing reference clusters that are matched by the sample
+    and information about the called variants and detected AMR associated genes respectively.
+    With native_match the summary is None: the cluster match flags are computed from the report.
+    """
+    summary = None if native_match else "summary_output_full/" + sra + "_summary.csv"
+    ariba_output = "aribaResult_withBam/outRun_" + sra + "/report.tsv"
+    return summary, ariba_output
+
+
+def ingest_reports(sra_list, native_match=False):
+    """
+    Parse the ariba output of every isolate in sra_list exactly once.
+    Return the accessions that have a report file, the vocabulary of the genetic features
+    detected in them and the feature IDs of each isolate as sparse rows (indptr, indices),
+    i.e. the IDs of the ith isolate are indices[indptr[i]:indptr[i + 1]].
+    """
+    sra_withReport = []
+    vocab = FeatureVocabulary()
+    indptr = [0]
+    indices = []
+    for sra in sra_list:
+        summary, ariba_output = ariba_output_paths(sra, native_match)
         if os.path.isfile(ariba_output):
-            df = pd.read_csv(ariba_output, sep="\t")
-            df_summary = pd.read_csv(summary, sep=",")
-            n_row = len(df)
-            for i in range(0, n_row):
-                # check if the sample matches the cluster presenting in ith line of report file
-                if df_summary[df["cluster"][i] + ".match"][0] == "yes":
-                    # Add gene present
-                    if (
-                        not (df["ref_name"][i] in raw_feature)
-                        and df["known_var"][i] == "."
-                    ):
-                        raw_feature.extend([df["ref_name"][i]])
-                    # Add novel variant that is located on a coding gene
-                    if (
-                        df["known_var"][i] == "0"
-                        and df["gene"][i] == "1"
-                        and not (
-                            (df["ref_name"][i] + "." + df["ref_ctg_change"][i])
-                            in raw_feature
-                        )
-                    ):
-                        # cov% could be added in sumary. For insertion and deletion, there is no cov %
-                        raw_feature.extend(
-                            [df["ref_name"][i] + "." + df["ref_ctg_change"][i]]
-                        )
-                    # Add detected know variant
-                    if (
-                        df["known_var"][i] == "1"
-                        and df["has_known_var"][i] == "1"
-                        and not (
-                            (df["ref_name"][i] + "." + df["known_var_change"][i])
-                            in raw_feature
-                        )
-                    ):
-                        raw_feature.extend(
-                            [df["ref_name"][i] + "." + df["known_var_change"][i]]
-                        )
-
-    # when lineage is needed
-    raw_feature.extend(lineage)
-    np.savetxt("raw_fList.txt", raw_feature, fmt="%s")
-    return raw_feature
+            sra_withReport.append(sra)
+            ids = vocab.update(parse_report_features(summary, ariba_output))
+            indices.append(ids)
+            indptr.append(indptr[-1] + len(ids))
+    indices = np.concatenate(indices) if indices else np.zeros(0, dtype=np.int64)
+    return sra_withReport, vocab, np.array(indptr, dtype=np.int64), indices
+
+
+def _ingest_shard(sra_list, native_match=False):
+    """Worker of ingest_reports_parallel(); the vocabulary is returned as a plain list"""
+    sra_withReport, vocab, indptr, indices = ingest_reports(sra_list, native_match)
+    return sra_withReport, vocab.names, indptr, indices
+
+
+def ingest_reports_parallel(sra_list, workers, native_match=False):
+    """
+    Same as ingest_reports() with contiguous shards of sra_list parsed in a pool of worker
+    processes. The per-shard vocabularies and rows are merged in shard order, so the row and
+    feature orders are identical to a serial run.
+    """
+    # a few shards per worker to even out the load
+    n_shards = min(len(sra_list), workers * 4) or 1
+    bounds = np.linspace(0, len(sra_list), n_shards + 1).astype(int)
+    shards = [sra_list[bounds[k] : bounds[k + 1]] for k in range(n_shards)]
+
+    sra_withReport = []
+    vocab = FeatureVocabulary()
+    indptr = [np.zeros(1, dtype=np.int64)]
+    indices = [np.zeros(0, dtype=np.int64)]
+    with ProcessPoolExecutor(max_workers=workers) as exe:
+        for shard_sra, shard_names, shard_indptr, shard_indices in exe.map(
+            _ingest_shard, shards, [native_match] * len(shards)
+        ):
+            # features new to the merged vocabulary are added in the order the shard first saw them
+            remap = vocab.update(shard_names)
+            sra_withReport.extend(shard_sra)
+            indptr.append(shard_indptr[1:] + indptr[-1][-1])
+            indices.append(remap[shard_indices])
+    return sra_withReport, vocab, np.concatenate(indptr), np.concatenate(indices)
+
+
+def update_feature_store(store, sra_list, workers=1, native_match=False):
+    """
+    Parse only the isolates in sra_list that are not in the feature store yet or whose ariba
+    output changed since they were stored, and put their features into the store.
+    Return the accessions in sra_list that have a report file.
+    """
+    sra_withReport = []
+    changed = {}
+    for sra in sra_list:
+        summary, ariba_output = ariba_output_paths(sra, native_match)
+        if os.path.isfile(ariba_output):
+            sra_withReport.append(sra)
+            if not store.is_current(sra, summary, ariba_output):
+                changed[sra] = True
+
+    if changed:
+        changed = list(changed)
+        if workers > 1:
+            sra_parsed, vocab, indptr, indices = ingest_reports_parallel(
+                changed, workers, native_match
+            )
+        else:
+            sra_parsed, vocab, indptr, indices = ingest_reports(changed, native_match)
+        for i, sra in enumerate(sra_parsed):
+            summary, ariba_output = ariba_output_paths(sra, native_match)
+            features = [vocab.names[k] for k in indices[indptr[i] : indptr[i + 1]]]
+            store.put(sra, features, summary, ariba_output)
+    print(
+        "Parsed {} new or changed of {} isolates with a report".format(
+            len(changed), len(sra_withReport)
+        )
+    )
+    return sra_withReport
+
+
+def open_feature_store(path=STORE_PATH, rebuild=False):
+    """
+    The feature store at path with the lineages as its first columns, or a new empty one if there
+    is none, if rebuild, or if the stored one was built with other fixed columns.
+    """
+    if os.path.isfile(path) and not rebuild:
+        store = FeatureStore.load(path)
+        if store.fixed == lineage:
+            return store
+        print("Feature store {} has other fixed columns, rebuilding it".format(path))
+    return FeatureStore(lineage)
 
 
-def generate_sra_lineage_map(sourceF):
+def get_variable_names(vocab):
     """
-    Generate a dictionary that map lineage info to corresponding isolates
+    Select AMR associated know variants and gene presents, and novel variants that on coding regions  into
+    feature vector for training and testing ML models,which are detected from at least one isolate.
+    The feature list is saved in raw_fList.txt and as a vocabulary (name -> column index) in VOCAB_PATH.
     """
-    df = pd.read_excel(sourceF, sheet_name="Sheet1")
-    df.fillna("", inplace=True)
-    # print (df['lineage'].unique())
-    sra_lineage = {}
-    for i, j in df.iterrows():
-        l = j["lineage"].replace(" ", "")
-        # if l!='' and l!='M.microti':
-        if l != "":
-            if l == "M.microti":
-                print(j["SRA"])
-            sral = j["SRA"].split()
-            for s in sral:
-                sra_lineage[s] = l
-    return sra_lineage
+    raw_feature = FeatureVocabulary(vocab)
+
+    # when lineage is needed; the lineages are already the first columns of the feature store
+    # vocabularies (see open_feature_store()), other vocabularies get them appended
+    raw_feature.update(lineage)
+    np.savetxt("raw_fList.txt", raw_feature.names, fmt="%s")
+    raw_feature.save(VOCAB_PATH)
+    return raw_feature
 
 
 def generate_featureVector_forOneIsoform(
-    raw_features, summary_path, report_path, sra_acc, sra_lineage_dic
+    raw_features, summary_path, report_path, lineage
 ):
     """
     Create the feature vector for one sample by parsing the report file (report_pat) to 
     obtain the value for AMR associated variants and gene present, which are listed in 
-    raw_feature, and adding corresponding lineage info.
-    """
-    ini_dic = {}
-    f_vector = []
-    feature_complete = 0
-    for f in raw_features:
-        ini_dic[f] = 0
-    # loop the report file to change the value in the dic if match any key of the dic.
-    df = pd.read_csv(report_path, sep="\t")
-    df_summary = pd.read_csv(summary_path, sep=",")
-    n_row = len(df)
-
-    for i in range(0, n_row):
-        if df_summary[df["cluster"][i] + ".match"][0] == "yes":
-            if df["known_var"][i] == ".":
-                ini_dic[df["ref_name"][i]] = 1
-
-            if df["known_var"][i] == "0" and df["gene"][i] == "1":
-                ini_dic[df["ref_name"][i] + "." + df["ref_ctg_change"][i]] = 1
-
-            if df["known_var"][i] == "1" and df["has_known_var"][i] == "1":
-                ini_dic[df["ref_name"][i] + "." + df["known_var_change"][i]] = 1
-
-    ini_dic[sra_lineage_dic[sra_acc]] = 1
-
-    for f in raw_features:
-        f_vector.append(ini_dic[f])
-
-    return f_vector
-
-
-def generate_dic_nonGenFeature_label(nonGenFeature_label_file_path):
-    """Save phenotype (label) and non genetic data into dic  phenotype_nonGenFeature"""
-    col_add = [
-        "sra_accession",
-        "isolation_country",
-        "genome_quality",
-        "amikacin",
-        "capreomycin",
-        "ethambutol",
-        "isoniazid",
-        "kanamycin",
-        "ofloxacin",
-        "pyrazinamide",
-        "rifampin",
-        "rifampicin",
-        "streptomycin",
-    ]
-
-    phenotype_nonGenFeature = {}
-    with open(nonGenFeature_label_file_path, "r") as fh:
-        for line in fh:
-            line.rstrip()
-            item = line.split("\t")
-            single_sraDic = {}
-            for i in range(1, len(col_add)):
-                single_sraDic[col_add[i]] = item[i]
-
-            phenotype_nonGenFeature[item[0]] = single_sraDic
-
-    return phenotype_nonGenFeature
-
-
-def generate_featureMatrics_labelList(
-    raw_list, phenotype_nonGenFeature, sra_lineage_mapping_dic, drug
-):
+    raw_feature, and adding its lineage (see metadata_cache.MetadataCache.lineage()).
     """
-    Loop all samples (over 10,000) to generate feature matrix in f_matrics wrote in featureM_X_'+antibio+'.txt',
-    labels in y wrote in 'label_Y_'+antibio+'.txt'，and SRA in "sra_withFeature_"+drug+".txt", which will be input data
+    if not isinstance(raw_features, FeatureVocabulary):
+        raw_features = FeatureVocabulary(raw_features)
+    return feature_vector(raw_features, summary_path, report_path, lineage).tolist()
+
+
+def build_feature_matrix(vocab, sra_withReport, indptr, indices, metadata):
+    """
+    Build the sample x feature matrix (scipy.sparse CSR) for all isolates with a report file in one
+    go from the sparse rows returned by ingest_reports(). Rows follow sra_withReport and columns follow
+    the feature vocabulary. Also return a mask of the isolates that have lineage info, as only
+    those are used for training.
+    """
+    codes = metadata.lineage_codes_for(sra_withReport)
+    has_lineage = codes != NO_LINEAGE
+    # column of every lineage code; lineages that are not in the feature list (e.g. M.microti)
+    # are dropped as before
+    lineage_cols = np.array(
+        [vocab.index(l) if l in vocab else -1 for l in metadata.lineage_names] + [-1],
+        dtype=np.int64,
+    )[codes]
+    with_col = lineage_cols >= 0
+    rows = np.concatenate(
+        [
+            np.repeat(np.arange(len(sra_withReport)), np.diff(indptr)),
+            np.flatnonzero(with_col),
+        ]
+    )
+    cols = np.concatenate([indices, lineage_cols[with_col]])
+    f_matrics = sp.csr_matrix(
+        (np.ones(len(rows), dtype=np.int8), (rows, cols)),
+        shape=(len(sra_withReport), len(vocab)),
+    )
+    return f_matrics, has_lineage
+
+
+def build_phenotype_table(sra_withReport, metadata, drugs):
+    """
+    Build the phenotype table (isolate x drug) aligned with the rows of the feature matrix.
+    Isolates without phenotype for a drug get the label MISSING_LABEL.
+    """
+    return pd.DataFrame(
+        metadata.labels_for(sra_withReport, drugs), index=sra_withReport, columns=drugs
+    )
+
+
+def generate_featureMatrics_labelList(f_matrics, has_lineage, phenotype_table, drug):
+    """
+    Select the samples (over 10,000) that have lineage info and a phenotype for drug from the full
+    feature matrix to generate the feature matrix wrote in featureM_X_'+antibio+'.txt', labels
+    wrote in 'label_Y_'+antibio+'.txt'，and SRA in "sra_withFeature_"+drug+".txt", which will be input data
     for training ML models. These three files are corresponded based on the order of rows.
-    They could be put in one file in next version.
-    """
-    sra_list = loadAccessions()
-    n_sra = len(sra_list)
-    f_matrics = []
-    y = []
-    f = open("sra_withFeature_" + drug + ".txt", "w")
-    for j in range(0, n_sra):
-        sra = sra_list[j]
-        summary = "summary_output_full/" + sra + "_summary.csv"
-        report = "aribaResult_withBam/outRun_" + sra + "/report.tsv"
-        if (
-            sra in phenotype_nonGenFeature.keys()
-            and sra in sra_lineage_mapping_dic.keys()
-        ):
-            if os.path.isfile(report) and phenotype_nonGenFeature[sra][drug] != "":
-                f.write(sra + "\n")
-                single_fVector = generate_featureVector_forOneIsoform(
-                    raw_list, summary, report, sra, sra_lineage_mapping_dic
-                )
-                f_matrics.append(single_fVector)
-                # get lable list for rifampicin
-                y.append(int(phenotype_nonGenFeature[sra][drug]))
-    f.close()
-    return (f_matrics, y)
-
-
-raw_list = get_variable_names()
-
-# Phenotype and lineage data are available in the supplementary file of the source paper
-# https://www.nejm.org/doi/full/10.1056/nejmoa1800474.
-# We organize phenotype data in 'phenotype.tsv' and lineage data in 'lineage.xls'
-sra_lineage_map = generate_sra_lineage_map("lineage.xls")
-phenotype_nonGenFeature = generate_dic_nonGenFeature_label("phenotype.tsv")
-
-# Generate input data for training ML models for the 4 first-line TB drugs resistance prediction
-for antibio in firstLine_TB_4antibio:
-    f_matrics, y = generate_featureMatrics_labelList(
-        raw_list, phenotype_nonGenFeature, sra_lineage_map, antibio
+    They are also put in one binary dataset by main().
+    """
+    labels = phenotype_table[drug].values
+    mask = has_lineage & (labels != MISSING_LABEL)
+    sra_list = phenotype_table.index[mask].tolist()
+    with open("sra_withFeature_" + drug + ".txt", "w") as f:
+        for sra in sra_list:
+            f.write(sra + "\n")
+    return (f_matrics[mask], labels[mask], sra_list)
+
+
+def getArgs():
+    parser = ArgumentParser(
+        prog="get_feature_vector.py",
+        description="Generate feature matrices, labels and SRA lists for the 4 first-line TB drugs.",
     )
-    print(len(y))
-    print(len(f_matrics))
-    np.savetxt("single_featureM_X_" + antibio + ".txt", f_matrics, fmt="%d")
-    np.savetxt("single_label_Y_" + antibio + ".txt", y, fmt="%d")
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of processes parsing ariba reports (default: 1, serial)",
+    )
+    parser.add_argument(
+        "-s",
+        "--store",
+        default=STORE_PATH,
+        help="Feature store of parsed isolates, only new or changed isolates are parsed (default: {})".format(
+            STORE_PATH
+        ),
+    )
+    parser.add_argument(
+        "--rebuild",
+        action="store_true",
+        help="Ignore the existing feature store and parse every isolate again",
+    )
+    parser.add_argument(
+        "--native_match",
+        action="store_true",
+        help="Compute the cluster match flags from report.tsv instead of reading summary_output_full/ (no ariba summary needed)",
+    )
+    parser.add_argument(
+        "--text",
+        action="store_true",
+        help="Also write the feature matrices as text (single_featureM_X_<drug>.txt)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    store = open_feature_store(args.store, args.rebuild)
+    sra_withReport = update_feature_store(
+        store, loadAccessions(), args.workers, args.native_match
+    )
+    store.save(args.store)
+    # the same columns as a rebuild: lineages first, then the features of the current isolates
+    vocab, indptr, indices = store.cohort_rows(sra_withReport)
+    raw_list = get_variable_names(vocab)
+
+    # Phenotype and lineage data are available in the supplementary file of the source paper
+    # https://www.nejm.org/doi/full/10.1056/nejmoa1800474.
+    # We organize phenotype data in 'phenotype.tsv' and lineage data in 'lineage.xls', which are
+    # converted once into metadata_cache.npz
+    metadata = load_metadata()
+
+    # Every report is parsed at most once above; the matrices of the 4 drugs are row selections of one matrix
+    f_matrics_all, has_lineage = build_feature_matrix(
+        raw_list, sra_withReport, indptr, indices, metadata
+    )
+    phenotype_table = build_phenotype_table(
+        sra_withReport, metadata, firstLine_TB_4antibio
+    )
+
+    # Generate input data for training ML models for the 4 first-line TB drugs resistance prediction
+    for antibio in firstLine_TB_4antibio:
+        f_matrics, y, sra_drug = generate_featureMatrics_labelList(
+            f_matrics_all, has_lineage, phenotype_table, antibio
+        )
+        print(len(y))
+        print(f_matrics.shape[0])
+        # featureM_X_<drug>.npy and featureM_X_<drug>.meta.npz, read by feature_dataset.load_dataset()
+        save_dataset(antibio, f_matrics, y, sra_drug, raw_list.names)
+        if args.text:
+            np.savetxt(
+                "single_featureM_X_" + antibio + ".txt", f_matrics.toarray(), fmt="%d"
+            )
+        np.savetxt("single_label_Y_" + antibio + ".txt", y, fmt="%d")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+"""
+SQLite ledger of the per-accession, per-stage job state of the pipeline runners
+(fasterq_download.py, runAribaInLoop_withBam.py, run_summary_inLoop.py, run_Mykrobe_inLoop.py).
+Every run of a stage records its state, attempt count, duration and exit code, so a restart
+selects the accessions to (re)process from one query instead of checking output files one by
+one, and failures are kept on record.
+"""
+
+import json
+import sqlite3
+import threading
+import time
+
+LEDGER_PATH = "pipeline_ledger.sqlite"
+
+PENDING = "pending"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    accession TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    state TEXT NOT NULL,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    started REAL,
+    duration REAL,
+    exit_code INTEGER,
+    info TEXT NOT NULL DEFAULT '{}',
+    updated REAL NOT NULL,
+    PRIMARY KEY (accession, stage)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS jobs_stage_state ON jobs (stage, state);
+"""
+
+
+def add_ledger_args(parser):
+    """Add the --ledger, --only-failed and --only-pending options shared by the runners"""
+    parser.add_argument(
+        "--ledger",
+        default=LEDGER_PATH,
+        help="SQLite job ledger (default: {})".format(LEDGER_PATH),
+    )
+    parser.add_argument(
+        "--only-failed",
+        action="store_true",
+        help="Only process accessions whose last run of this stage failed",
+    )
+    parser.add_argument(
+        "--only-pending",
+        action="store_true",
+        help="Only process accessions that were never run or were interrupted",
+    )
+
+
+class JobLedger(object):
+    """
+    Job state table (accession, stage) -> state, attempts, duration, exit code and an info dict.
+    One instance can be shared by the threads of a runner; several runners can use the same file.
+    """
+
+    def __init__(self, path=LEDGER_PATH):
+        self.path = path
+        self._conn = sqlite3.connect(
+            path, timeout=60, check_same_thread=False, isolation_level=None
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(_SCHEMA)
+        self._lock = threading.Lock()
+
+    def close(self):
+        self._conn.close()
+
+    def _execute(self, sql, params=()):
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    def get(self, accession, stage):
+        """Row of the job as a dict, None if it was never recorded"""
+        rows = self._execute(
+            "SELECT state, attempts, started, duration, exit_code, info FROM jobs"
+            " WHERE accession = ? AND stage = ?",
+            (accession, stage),
+        )
+        if not rows:
+            return None
+        state, attempts, started, duration, exit_code, info = rows[0]
+        return {
+            "state": state,
+            "attempts": attempts,
+            "started": started,
+            "duration": duration,
+            "exit_code": exit_code,
+            "info": json.loads(info),
+        }
+
+    def states(self, stage):
+        """Map every recorded accession of stage to its state"""
+        return dict(
+            self._execute("SELECT accession, state FROM jobs WHERE stage = ?", (stage,))
+        )
+
+    def select(self, accessions, stage, only_failed=False, only_pending=False):
+        """
+        Accessions (in the given order) to process for stage: by default all that are not done,
+        with only_failed / only_pending those that failed / were never run or interrupted
+        (both flags select both groups).
+        """
+        states = self.states(stage)
+        if not (only_failed or only_pending):
+            return [sra for sra in accessions if states.get(sra) != DONE]
+        wanted = set()
+        if only_failed:
+            wanted.add(FAILED)
+        if only_pending:
+            wanted.update([None, PENDING, RUNNING])
+        return [sra for sra in accessions if states.get(sra) in wanted]
+
+    def start(self, accession, stage):
+        """Record a new attempt of the job"""
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (accession, stage, state, attempts, started, updated)"
+            " VALUES (?, ?, ?, 1, ?, ?)"
+            " ON CONFLICT (accession, stage) DO UPDATE SET state = excluded.state,"
+            " attempts = attempts + 1, started = excluded.started, duration = NULL,"
+            " exit_code = NULL, updated = excluded.updated",
+            (accession, stage, RUNNING, now, now),
+        )
+
+    def finish(self, accession, stage, exit_code, **info):
+        """
+        Record the end of the running attempt: done if exit_code is 0, failed otherwise
+        (None for a job that failed without running a command). info is merged into the info dict.
+        """
+        now = time.time()
+        state = DONE if exit_code == 0 else FAILED
+        self._execute(
+            "UPDATE jobs SET state = ?, duration = ? - started, exit_code = ?,"
+            " info = json_patch(info, ?), updated = ? WHERE accession = ? AND stage = ?",
+            (state, now, exit_code, json.dumps(info), now, accession, stage),
+        )
+
+    def mark(self, accession, stage, state, **info):
+        """Set the state of a job without an attempt, e.g. done for outputs found on disk"""
+        now = time.time()
+        self._execute(
+            "INSERT INTO jobs (accession, stage, state, info, updated) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (accession, stage) DO UPDATE SET state = excluded.state,"
+            " info = json_patch(info, excluded.info), updated = excluded.updated",
+            (accession, stage, state, json.dumps(info), now),
+        )
+
+    def update_info(self, accession, stage, **info):
+        """Merge info into the info dict of a recorded job"""
+        self._execute(
+            "UPDATE jobs SET info = json_patch(info, ?), updated = ?"
+            " WHERE accession = ? AND stage = ?",
+            (json.dumps(info), time.time(), accession, stage),
+        )
+
+    def summary(self, stage):
+        """Number of jobs of stage per state"""
+        return dict(
+            self._execute(
+                "SELECT state, COUNT(*) FROM jobs WHERE stage = ? GROUP BY state",
+                (stage,),
+            )
+        )
@@ -0,0 +1,193 @@
+"""
+Columnar cache of the isolate metadata in lineage.xls and phenotype.tsv. Both files are converted
+once into metadata_cache.npz, which holds one row per accession with its lineage code and its
+phenotype label for every drug. The cache is rebuilt when the size or mtime of a source file
+changes, otherwise it is loaded without reading the spreadsheet.
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+
+CACHE_PATH = "metadata_cache.npz"
+LINEAGE_PATH = "lineage.xls"
+PHENOTYPE_PATH = "phenotype.tsv"
+# columns of phenotype.tsv
+PHENOTYPE_COLUMNS = [
+    "sra_accession",
+    "isolation_country",
+    "genome_quality",
+    "amikacin",
+    "capreomycin",
+    "ethambutol",
+    "isoniazid",
+    "kanamycin",
+    "ofloxacin",
+    "pyrazinamide",
+    "rifampin",
+    "rifampicin",
+    "streptomycin",
+]
+DRUGS = PHENOTYPE_COLUMNS[3:]
+# label of isolates without phenotype for a drug
+MISSING_LABEL = -1
+# lineage code of isolates without lineage info
+NO_LINEAGE = -1
+
+
+def read_lineage(lineage_path=LINEAGE_PATH):
+    """
+    Map every SRA accession of the lineage spreadsheet to its lineage (spaces removed).
+    A row may list several accessions separated by white space; rows without lineage are skipped.
+    """
+    df = pd.read_excel(lineage_path, sheet_name="Sheet1")
+    df = df.fillna("")
+    lineages = df["lineage"].astype(str).str.replace(" ", "")
+    sra = df["SRA"].astype(str).str.split()
+    df = pd.DataFrame({"SRA": sra, "lineage": lineages})[lineages != ""]
+    df = df.explode("SRA").dropna(subset=["SRA"])
+    # later rows win, as when the map was filled row by row
+    return dict(zip(df["SRA"], df["lineage"]))
+
+
+def read_phenotype(phenotype_path=PHENOTYPE_PATH):
+    """Map every accession of phenotype.tsv to its labels of DRUGS (MISSING_LABEL if empty)"""
+    phenotype = {}
+    with open(phenotype_path) as fh:
+        for line in fh:
+            item = line.rstrip("\n").split("\t")
+            labels = []
+            for value in item[3 : len(PHENOTYPE_COLUMNS)]:
+                value = value.strip()
+                labels.append(
+                    int(value) if value.lstrip("-").isdigit() else MISSING_LABEL
+                )
+            labels += [MISSING_LABEL] * (len(DRUGS) - len(labels))
+            phenotype[item[0]] = labels
+    return phenotype
+
+
+def source_signature(paths):
+    """(size, mtime) of every existing source file, (-1, -1) for missing ones"""
+    sig = []
+    for path in paths:
+        if os.path.isfile(path):
+            st = os.stat(path)
+            sig.extend([st.st_size, st.st_mtime_ns])
+        else:
+            sig.extend([-1, -1])
+    return np.array(sig, dtype=np.int64)
+
+
+class MetadataCache(object):
+    """Lineage code and per-drug labels of every accession, with O(1) accession lookup"""
+
+    def __init__(self, accessions, lineage_names, lineage_codes, labels, drugs=DRUGS):
+        self.accessions = list(accessions)
+        self.lineage_names = list(lineage_names)
+        self.lineage_codes = np.asarray(lineage_codes, dtype=np.int16)
+        self.labels = np.asarray(labels, dtype=np.int8)
+        self.drugs = list(drugs)
+        self._index = {sra: i for i, sra in enumerate(self.accessions)}
+        self._drug_index = {drug: k for k, drug in enumerate(self.drugs)}
+        # source_signature() of the files the cache was built from
+        self.signature = np.zeros(0, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.accessions)
+
+    def __contains__(self, sra):
+        return sra in self._index
+
+    @classmethod
+    def build(cls, lineage_path=LINEAGE_PATH, phenotype_path=PHENOTYPE_PATH):
+        """Convert the lineage spreadsheet and the phenotype table into the columnar cache"""
+        sra_lineage = read_lineage(lineage_path)
+        phenotype = read_phenotype(phenotype_path)
+        accessions = list(phenotype)
+        accessions += [sra for sra in sra_lineage if sra not in phenotype]
+        lineage_names = sorted(set(sra_lineage.values()))
+        code = {l: i for i, l in enumerate(lineage_names)}
+        lineage_codes = [
+            code.get(sra_lineage.get(sra), NO_LINEAGE) for sra in accessions
+        ]
+        labels = np.full((len(accessions), len(DRUGS)), MISSING_LABEL, dtype=np.int8)
+        for i, sra in enumerate(accessions):
+            if sra in phenotype:
+                labels[i] = phenotype[sra]
+        return cls(accessions, lineage_names, lineage_codes, labels)
+
+    def rows(self, sra_list):
+        """Row of every accession in sra_list, -1 for unknown accessions"""
+        return np.array([self._index.get(sra, -1) for sra in sra_list], dtype=np.int64)
+
+    def lineage(self, sra):
+        """Lineage of sra, or None if it has no lineage info"""
+        i = self._index.get(sra)
+        if i is None or self.lineage_codes[i] == NO_LINEAGE:
+            return None
+        return self.lineage_names[self.lineage_codes[i]]
+
+    def lineage_codes_for(self, sra_list):
+        """Lineage codes of the accessions in sra_list, NO_LINEAGE for unknown ones"""
+        rows = self.rows(sra_list)
+        codes = np.full(len(rows), NO_LINEAGE, dtype=np.int16)
+        known = rows >= 0
+        codes[known] = self.lineage_codes[rows[known]]
+        return codes
+
+    def labels_for(self, sra_list, drugs):
+        """Labels (accession x drug) of sra_list, MISSING_LABEL for unknown accessions"""
+        rows = self.rows(sra_list)
+        cols = [self._drug_index[drug] for drug in drugs]
+        labels = np.full((len(rows), len(cols)), MISSING_LABEL, dtype=np.int8)
+        known = rows >= 0
+        labels[known] = self.labels[np.ix_(rows[known], cols)]
+        return labels
+
+    def save(self, path=CACHE_PATH, signature=()):
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                accessions=np.array(self.accessions, dtype=str),
+                lineage_names=np.array(self.lineage_names, dtype=str),
+                lineage_codes=self.lineage_codes,
+                labels=self.labels,
+                drugs=np.array(self.drugs, dtype=str),
+                signature=np.asarray(signature, dtype=np.int64),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=CACHE_PATH):
+        with np.load(path) as data:
+            cache = cls(
+                data["accessions"].tolist(),
+                data["lineage_names"].tolist(),
+                data["lineage_codes"],
+                data["labels"],
+                data["drugs"].tolist(),
+            )
+            cache.signature = data["signature"]
+        return cache
+
+
+def load_metadata(
+    path=CACHE_PATH, lineage_path=LINEAGE_PATH, phenotype_path=PHENOTYPE_PATH
+):
+    """
+    Load the metadata cache, (re)building it first if it is missing or a source file changed.
+    A cache whose source files are not around (e.g. on a prediction machine) is used as is.
+    """
+    sources = [lineage_path, phenotype_path]
+    if os.path.isfile(path):
+        cache = MetadataCache.load(path)
+        if not any(os.path.isfile(p) for p in sources) or np.array_equal(
+            cache.signature, source_signature(sources)
+        ):
+            return cache
+    cache = MetadataCache.build(lineage_path, phenotype_path)
+    cache.save(path, source_signature(sources))
+    return cache
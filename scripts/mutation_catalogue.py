@@ -0,0 +1,268 @@
+"""
+Index of the resistance mutations of the repo: the 'mutations' list (rpoB mutations of the
+rifampicin resistance-determining region) and the variants of the ARIBA reference metadata
+out1.card.tsv. Mutations are normalized (one-letter amino acids, in-frame insertions of a
+flanking residue written as dup, single-residue delins as substitutions) and kept in a dict
+keyed by (gene, mutation), so a report row is checked with one hash lookup per change.
+The ref_ctg_change / known_var_change values ARIBA writes (S450L, F433_T434insF, Q432del, ...)
+are normalized the same way.
+"""
+
+import re
+from argparse import ArgumentParser
+from functools import lru_cache
+
+from ariba_report import read_report
+
+MUTATIONS_PATH = "mutations"
+CARD_TSV = "out1.card.tsv"
+# the 'mutations' list has neither gene nor drug columns
+MUTATIONS_GENE = "rpoB"
+MUTATIONS_DRUGS = ("rifampicin",)
+
+THREE_TO_ONE = {
+    "Ala": "A",
+    "Arg": "R",
+    "Asn": "N",
+    "Asp": "D",
+    "Cys": "C",
+    "Gln": "Q",
+    "Glu": "E",
+    "Gly": "G",
+    "His": "H",
+    "Ile": "I",
+    "Leu": "L",
+    "Lys": "K",
+    "Met": "M",
+    "Phe": "F",
+    "Pro": "P",
+    "Ser": "S",
+    "Thr": "T",
+    "Trp": "W",
+    "Tyr": "Y",
+    "Val": "V",
+    "Ter": "*",
+}
+# 'any substitution' (D435Var in out1.card.tsv), kept as <ref><pos>?
+ANY = "?"
+
+_RES = r"([A-Z*]|[A-Z][a-z]{2})"
+_SUB = re.compile(r"^{}(-?\d+){}$".format(_RES, _RES))
+_RANGE = r"^{}(-?\d+)(?:_{}(-?\d+))?".format(_RES, _RES)
+_DUP = re.compile(_RANGE + r"dup$")
+_DEL = re.compile(_RANGE + r"del$")
+# inserted residues in one-letter or three-letter codes (delinsL, delinsHisGly)
+_SEQ = r"((?:[A-Z][a-z]{2})+|[A-Z*]+)"
+_DELINS = re.compile(_RANGE + r"delins" + _SEQ + "$")
+_INS = re.compile(r"^{}(-?\d+)_{}(-?\d+)ins{}$".format(_RES, _RES, _SEQ))
+_END = re.compile(r"^{}(-?\d+)(trunc|fs)$".format(_RES))
+
+
+def _aa(res):
+    """One-letter code of a residue given as one letter or three letters (Var: any)"""
+    if len(res) == 1:
+        return res
+    if res == "Var":
+        return ANY
+    return THREE_TO_ONE.get(res, res)
+
+
+def _seq(residues):
+    """One-letter codes of a residue sequence given in one-letter or three-letter codes"""
+    if residues[1:2].islower():
+        return "".join(_aa(residues[i : i + 3]) for i in range(0, len(residues), 3))
+    return residues
+
+
+def _span(a, p, b, q, suffix):
+    if b is None or (a == b and p == q):
+        return "{}{}{}".format(_aa(a), p, suffix)
+    return "{}{}_{}{}{}".format(_aa(a), p, _aa(b), q, suffix)
+
+
+@lru_cache(maxsize=None)
+def normalize(mutation):
+    """
+    Canonical form of a mutation, e.g. Ser450Leu -> S450L, F433_T434insF -> F433dup,
+    Q432delinsL -> Q432L, L432_F433insF -> F433dup, Gln432_Asp435delinsHis -> Q432_D435delinsH.
+    Unparsed strings are returned as they are.
+    """
+    m = _SUB.match(mutation)
+    if m:
+        ref, pos, alt = m.groups()
+        return "{}{}{}".format(_aa(ref), pos, _aa(alt))
+    m = _DUP.match(mutation)
+    if m:
+        return _span(*m.groups(), "dup")
+    m = _DELINS.match(mutation)
+    if m:
+        a, p, b, q, new = m.groups()
+        new = _seq(new)
+        if (b is None or p == q) and len(new) == 1:
+            return "{}{}{}".format(_aa(a), p, new)
+        return _span(a, p, b, q, "delins" + new)
+    m = _DEL.match(mutation)
+    if m:
+        return _span(*m.groups(), "del")
+    m = _INS.match(mutation)
+    if m:
+        a, p, b, q, new = m.groups()
+        a, b, new = _aa(a), _aa(b), _seq(new)
+        # an inserted residue equal to a flank is a duplication of that residue
+        if new == a:
+            return "{}{}dup".format(a, p)
+        if new == b:
+            return "{}{}dup".format(b, q)
+        return "{}{}_{}{}ins{}".format(a, p, b, q, new)
+    m = _END.match(mutation)
+    if m:
+        ref, pos, kind = m.groups()
+        return "{}{}{}".format(_aa(ref), pos, kind)
+    return mutation
+
+
+def _any_key(mutation):
+    """
+    <ref><pos>? of a (normalized) amino acid change, None for other mutations: synonymous
+    changes, stop gains and non-substitutions are not covered by 'any substitution'
+    """
+    m = _SUB.match(mutation)
+    if m is None:
+        return None
+    ref, pos, alt = m.groups()
+    if alt == ref or alt in ("*", ANY) or ref == "*":
+        return None
+    return "{}{}{}".format(ref, pos, ANY)
+
+
+def gene_name(ref_name):
+    """Gene of an ARIBA reference name, e.g. rpoB.3003283.NC_000962.3.759806-763325.8799 -> rpoB"""
+    return ref_name.split(".", 1)[0]
+
+
+def description_drugs(description):
+    """Drugs named in a CARD variant description, e.g. '... resulting in resistance to rifampicin.'"""
+    m = re.search(r"resistance to ([^.']+)", description)
+    if m is None:
+        return ()
+    return tuple(
+        d.strip().lower() for d in re.split(r",| and ", m.group(1)) if d.strip()
+    )
+
+
+class MutationCatalogue(object):
+    """Resistance mutations keyed by (gene, normalized mutation), each with the drugs it confers resistance to"""
+
+    def __init__(self):
+        self.entries = {}
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, key):
+        return self.lookup(*key) is not None
+
+    def add(self, gene, mutation, drugs):
+        key = (gene, normalize(mutation))
+        self.entries[key] = self.entries.get(key, frozenset()) | frozenset(drugs)
+
+    def add_mutation_list(
+        self, path=MUTATIONS_PATH, gene=MUTATIONS_GENE, drugs=MUTATIONS_DRUGS
+    ):
+        """One mutation per line, all of gene"""
+        with open(path) as f:
+            for line in f:
+                if line.strip():
+                    self.add(gene, line.strip(), drugs)
+
+    def add_card_tsv(self, path=CARD_TSV):
+        """Variants of an ARIBA metadata tsv (ref_name, gene, var_only, variant, group, description)"""
+        with open(path) as f:
+            for line in f:
+                cols = line.rstrip("\n").split("\t")
+                if len(cols) < 4 or cols[3] == ".":
+                    continue
+                description = cols[5] if len(cols) > 5 else ""
+                self.add(gene_name(cols[0]), cols[3], description_drugs(description))
+
+    def lookup(self, gene, mutation):
+        """Drugs of a mutation of gene (any spelling normalize() handles), None if it is not catalogued"""
+        mutation = normalize(mutation)
+        drugs = self.entries.get((gene, mutation))
+        if drugs is None:
+            any_key = _any_key(mutation)
+            if any_key is not None:
+                drugs = self.entries.get((gene, any_key))
+        return drugs
+
+    def match_report(self, report_df):
+        """
+        Catalogued mutations of an ARIBA report (ariba_report.read_report()): a list of
+        (cluster, gene, change, drugs) for every row whose ref_ctg_change or detected
+        known_var_change is in the catalogue.
+        """
+        hits = []
+        for cluster, ref_name, ref_ctg_change, has_known_var, known_var_change in zip(
+            report_df["cluster"],
+            report_df["ref_name"],
+            report_df["ref_ctg_change"],
+            report_df["has_known_var"],
+            report_df["known_var_change"],
+        ):
+            gene = gene_name(ref_name)
+            changes = {ref_ctg_change}
+            if has_known_var == "1":
+                changes.add(known_var_change)
+            changes.discard(".")
+            for change in changes:
+                drugs = self.lookup(gene, change)
+                if drugs is not None:
+                    hits.append((cluster, gene, change, drugs))
+        return hits
+
+    def resistant_drugs(self, report_df):
+        """Drugs the catalogued mutations of a report confer resistance to"""
+        return set().union(*(drugs for _, _, _, drugs in self.match_report(report_df)))
+
+
+@lru_cache(maxsize=None)
+def load_catalogue(mutations_path=MUTATIONS_PATH, card_tsv=CARD_TSV):
+    """Catalogue of the mutation list and the metadata tsv, built once per process"""
+    catalogue = MutationCatalogue()
+    catalogue.add_mutation_list(mutations_path)
+    catalogue.add_card_tsv(card_tsv)
+    return catalogue
+
+
+def getArgs():
+    parser = ArgumentParser(
+        prog="mutation_catalogue.py",
+        description="Check ARIBA reports against the catalogue of resistance mutations.",
+    )
+    parser.add_argument("reports", nargs="*", help="ARIBA report.tsv files to check")
+    parser.add_argument(
+        "-m",
+        "--mutations",
+        default=MUTATIONS_PATH,
+        help="Mutation list (default: {})".format(MUTATIONS_PATH),
+    )
+    parser.add_argument(
+        "-c",
+        "--card_tsv",
+        default=CARD_TSV,
+        help="ARIBA reference metadata tsv (default: {})".format(CARD_TSV),
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    catalogue = load_catalogue(args.mutations, args.card_tsv)
+    print("{} catalogued mutations".format(len(catalogue)))
+    for report in args.reports:
+        for cluster, gene, change, drugs in catalogue.match_report(read_report(report)):
+            print("\t".join([report, cluster, gene, change, ",".join(sorted(drugs))]))
+
+
+if __name__ == "__main__":
+    main()
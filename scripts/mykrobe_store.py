@@ -0,0 +1,190 @@
+"""
+Accession x drug table of the Mykrobe calls (susceptibility column of mykrobeOut/result_<sra>.csv),
+collected once into mykrobe_store.npz and updated incrementally: only result files that are new
+or whose size/mtime changed are parsed again, and accessions whose result file is gone are
+dropped. Drugs are lower-cased (as in AMR_prediction_validation_Ariba_Mykrobe.py); drugs seen for
+the first time are appended as new columns.
+"""
+
+import csv
+import os
+from argparse import ArgumentParser
+
+import numpy as np
+import pandas as pd
+
+from signed_files import SignedFiles
+
+STORE_PATH = "mykrobe_store.npz"
+MYKROBE_OUT = "mykrobeOut"
+# call of an accession without a result file or without a row for the drug
+MISSING = ""
+
+
+def result_path(sra, out_dir=MYKROBE_OUT):
+    return os.path.join(out_dir, "result_" + sra + ".csv")
+
+
+def result_accessions(out_dir=MYKROBE_OUT):
+    """Accessions with a result_<sra>.csv in out_dir"""
+    return sorted(
+        name[len("result_") : -len(".csv")]
+        for name in os.listdir(out_dir)
+        if name.startswith("result_") and name.endswith(".csv")
+    )
+
+
+def parse_result(path):
+    """Map drug (lower case) -> susceptibility call of a Mykrobe csv result"""
+    with open(path, newline="") as f:
+        return {
+            row["drug"].lower(): row["susceptibility"]
+            for row in csv.DictReader(f)
+            if row.get("drug")
+        }
+
+
+class MykrobeStore(object):
+    """Mykrobe calls of every collected accession plus the signature of its result file"""
+
+    def __init__(self):
+        self.drugs = []
+        self.calls = {}
+        # result file of every accession, by size/mtime only
+        self.files = SignedFiles(1, digests=False)
+
+    def __len__(self):
+        return len(self.calls)
+
+    def put(self, sra, calls, path):
+        """Store the calls parsed from the result file path of sra"""
+        for drug in calls:
+            if drug not in self.drugs:
+                self.drugs.append(drug)
+        self.calls[sra] = calls
+        self.files.sign(sra, path)
+
+    def update(self, sra_list=None, out_dir=MYKROBE_OUT):
+        """
+        Parse the result files of sra_list (default: every result file in out_dir) that are new or
+        changed since they were collected. Return the number of files parsed.
+        """
+        if sra_list is None:
+            found = result_accessions(out_dir) if os.path.isdir(out_dir) else []
+            # collected accessions missing from the listing are checked (and dropped) too
+            sra_list = found + sorted(set(self.calls) - set(found))
+        n_parsed = 0
+        for sra in sra_list:
+            path = result_path(sra, out_dir)
+            if not os.path.isfile(path):
+                self.calls.pop(sra, None)
+                self.files.discard(sra)
+                continue
+            if self.files.is_current(sra, path):
+                continue
+            self.put(sra, parse_result(path), path)
+            n_parsed += 1
+        return n_parsed
+
+    def table(self, sra_list=None):
+        """Calls as a DataFrame, one row per accession (default: all collected) and one column per drug"""
+        if sra_list is None:
+            sra_list = list(self.calls)
+        return pd.DataFrame(
+            [
+                [self.calls.get(sra, {}).get(drug, MISSING) for drug in self.drugs]
+                for sra in sra_list
+            ],
+            index=pd.Index(sra_list, name="SRA"),
+            columns=self.drugs,
+            dtype=object,
+        )
+
+    def predictions(self, sra_list, drug, default="S"):
+        """Calls of sra_list for drug, default for accessions without a call"""
+        drug = drug.lower()
+        return [
+            self.calls.get(sra, {}).get(drug, default) or default for sra in sra_list
+        ]
+
+    def save(self, path=STORE_PATH):
+        accessions = list(self.calls)
+        tmp = path + ".tmp"
+        with open(tmp, "wb") as f:
+            np.savez(
+                f,
+                drugs=np.array(self.drugs, dtype=str),
+                accessions=np.array(accessions, dtype=str),
+                calls=self.table(accessions)
+                .to_numpy(dtype=str)
+                .reshape(len(accessions), len(self.drugs)),
+                **self.files.arrays(accessions),
+            )
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path=STORE_PATH):
+        store = cls()
+        with np.load(path) as data:
+            store.drugs = data["drugs"].tolist()
+            calls = data["calls"].tolist()
+            accessions = data["accessions"].tolist()
+            for i, sra in enumerate(accessions):
+                store.calls[sra] = {
+                    drug: call
+                    for drug, call in zip(store.drugs, calls[i])
+                    if call != MISSING
+                }
+            store.files.load_arrays(accessions, data)
+        return store
+
+
+def update_store(path=STORE_PATH, out_dir=MYKROBE_OUT, sra_list=None):
+    """Load the store at path (or start an empty one), collect new and changed results and save it"""
+    store = MykrobeStore.load(path) if os.path.isfile(path) else MykrobeStore()
+    n_before = len(store)
+    n_parsed = store.update(sra_list, out_dir)
+    if n_parsed or len(store) != n_before or not os.path.isfile(path):
+        store.save(path)
+    return store, n_parsed
+
+
+def getArgs():
+    parser = ArgumentParser(
+        prog="mykrobe_store.py",
+        description="Collect the Mykrobe results into an accession x drug table of calls.",
+    )
+    parser.add_argument(
+        "-m",
+        "--mykrobe_out",
+        default=MYKROBE_OUT,
+        help="Directory of the Mykrobe results (default: {})".format(MYKROBE_OUT),
+    )
+    parser.add_argument(
+        "--store",
+        default=STORE_PATH,
+        help="Store of the collected calls (default: {})".format(STORE_PATH),
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        default=None,
+        help="Also write the table to this tsv",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    store, n_parsed = update_store(args.store, args.mykrobe_out)
+    print(
+        "{} accessions x {} drugs in {} ({} results parsed)".format(
+            len(store), len(store.drugs), args.store, n_parsed
+        )
+    )
+    if args.output:
+        store.table().to_csv(args.output, sep="\t")
+
+
+if __name__ == "__main__":
+    main()
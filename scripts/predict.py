@@ -1,9 +1,11 @@
-import numpy as np
 import joblib
-from sklearn.preprocessing import StandardScaler
 import os
-import pandas as pd
-import get_feature_vector as gfv
+# only the modules needed for prediction are imported; get_feature_vector.py (the training data
+# pipeline) is not
+from ariba_report import feature_vector
+from feature_vocabulary import FeatureVocabulary, VOCAB_PATH, model_vocab_path
+from feature_dataset import load_dataset
+from metadata_cache import load_metadata
 
 def load_model(model_path):
     """Load a saved model from the specified file path."""
@@ -15,14 +17,16 @@ def predict_susceptibility(model, scaler, feature_vector):
 
     Parameters:
         model: Trained machine learning model.
-        scaler: StandardScaler instance used for scaling.
+        scaler: StandardScaler instance used for scaling, or None if the model was trained on unscaled features.
         feature_vector: A 1D array of features for the genome.
 
     Returns:
         Prediction result (e.g., 0 = resistant, 1 = susceptible).
     """
     # Scale the feature vector
-    scaled_features = scaler.transform([feature_vector])
+    scaled_features = [feature_vector]
+    if scaler is not None:
+        scaled_features = scaler.transform(scaled_features)
 
     # Predict using the loaded model
     prediction = model.predict(scaled_features)
@@ -46,13 +50,36 @@ def get_model_accuracy(model):
     else:
         return "Accuracy not available"
 
+def check_feature_names(feature_names, drug, model=None):
+    """
+    Raise ValueError unless feature_names are the columns the model of drug was trained on, i.e. the
+    vocabulary saved next to the model (raw_fList.vocab.json for models saved without one).
+    A feature vector in another column layout would give wrong predictions without any error.
+    """
+    vocab_path = model_vocab_path(drug)
+    if not os.path.isfile(vocab_path):
+        vocab_path = VOCAB_PATH
+    training_names = FeatureVocabulary.load(vocab_path).names
+    n_model_features = getattr(model, "n_features_in_", len(training_names))
+    if n_model_features != len(training_names):
+        raise ValueError(
+            f"The {drug} model has {n_model_features} features, {vocab_path} lists {len(training_names)}"
+        )
+    if list(feature_names) != training_names:
+        raise ValueError(
+            f"The feature vector does not have the columns of the {drug} model ({vocab_path}); "
+            "regenerate the features or retrain the model"
+        )
+
 def main():
     # Define drugs and their corresponding models
     drugL = ["ethambutol", "isoniazid", "pyrazinamide", "rifampicin"]
 
     # Load new genome features (example: replace with actual file/input source)
     # genome_features = getFeature("ERR2512455")
-    genome_features = np.loadtxt("single_featureM_X_ethambutol.txt", dtype="i4")
+    # the first isolate of the binary dataset get_feature_vector.py writes (featureM_X_ethambutol)
+    example_features, _, _, feature_names = load_dataset("ethambutol", sparse=True)
+    genome_features = example_features[0].toarray().ravel()
 
     # Iterate over each drug and make predictions
     for drug in drugL:
@@ -61,17 +88,20 @@ def main():
         # Load the saved model and scaler
         model_path = f"random_forest_{drug}.joblib"  # Update to desired model file if needed
         model = load_model(model_path)
+        # The input feature vector must have the columns of the training data, names and order
+        check_feature_names(feature_names, drug, model)
 
-        # Load the scaler used during training
-        training_features = np.loadtxt(f"featureM_X_{drug}.txt", dtype="i4")
-        scaler = StandardScaler()
-        scaler.fit(training_features)
-        # Ensure the input feature vector matches the training data dimensions
-        if genome_features.shape[0] != training_features.shape[1]:
-            # If dimensions don't match, pad the feature vector with zeros
-            padded_features = np.zeros(training_features.shape[1], dtype=int)
-            padded_features[:genome_features.shape[0]] = genome_features
-            genome_features = padded_features
+        # Load the scaler used during training (None when trained without scaling)
+        scaler_path = f"scaler_{drug}.joblib"
+        if os.path.isfile(scaler_path):
+            scaler = load_model(scaler_path)
+        else:
+            from sklearn.preprocessing import StandardScaler
+
+            training_features, _, _, training_names = load_dataset(drug, sparse=True)
+            check_feature_names(training_names, drug, model)
+            scaler = StandardScaler(with_mean=False)
+            scaler.fit(training_features)
 
         # Predict susceptibility
         prediction = predict_susceptibility(model, scaler, genome_features)
@@ -86,50 +116,18 @@ def main():
 
         print(f"Model Accuracy: {accuracy}%)")
 
-def getFeature(sra):
-    raw_feature = []
+def getFeature(sra, vocab_path=VOCAB_PATH, native_match=False):
+    """
+    Feature vector of one isolate, with columns in the same order as the training feature
+    matrices (the vocabulary saved by get_feature_vector.py, or model_vocab_path(drug) for the
+    columns of the models of drug, see check_feature_names()). With native_match the cluster
+    match flags are computed from the report, so ariba summary need not have run.
+    """
     # summary and report files are outputs of ariba, containing reference clusters that are matched by the sample
     # and information about the called variants and detected AMR associated genes respectively
-    summary = "summary_output_full/" + sra + "_summary.csv"
+    summary = None if native_match else "summary_output_full/" + sra + "_summary.csv"
     ariba_output = "aribaResult_withBam/outRun_" + sra + "/report.tsv"
-    if os.path.isfile(ariba_output):
-        df = pd.read_csv(ariba_output, sep="\t")
-        df_summary = pd.read_csv(summary, sep=",")
-        n_row = len(df)
-        for i in range(0, n_row):
-            # check if the sample matches the cluster presenting in ith line of report file
-            if df_summary[df["cluster"][i] + ".match"][0] == "yes":
-                # Add gene present
-                if (
-                        not (df["ref_name"][i] in raw_feature)
-                        and df["known_var"][i] == "."
-                ):
-                    raw_feature.extend([df["ref_name"][i]])
-                # Add novel variant that is located on a coding gene
-                if (
-                        df["known_var"][i] == "0"
-                        and df["gene"][i] == "1"
-                        and not (
-                        (df["ref_name"][i] + "." + df["ref_ctg_change"][i])
-                        in raw_feature
-                )
-                ):
-                    # cov% could be added in sumary. For insertion and deletion, there is no cov %
-                    raw_feature.extend(
-                        [df["ref_name"][i] + "." + df["ref_ctg_change"][i]]
-                    )
-                # Add detected know variant
-                if (
-                        df["known_var"][i] == "1"
-                        and df["has_known_var"][i] == "1"
-                        and not (
-                        (df["ref_name"][i] + "." + df["known_var_change"][i])
-                        in raw_feature
-                )
-                ):
-                    raw_feature.extend(
-                        [df["ref_name"][i] + "." + df["known_var_change"][i]]
-                    )
-    return gfv.generate_featureVector_forOneIsoform(raw_feature, summary, ariba_output, sra, gfv.generate_sra_lineage_map("lineage.xls"))
+    vocab = FeatureVocabulary.load(vocab_path)
+    return feature_vector(vocab, summary, ariba_output, load_metadata().lineage(sra))
 if __name__ == "__main__":
     main()
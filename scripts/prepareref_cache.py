@@ -0,0 +1,165 @@
+"""
+Cache of ARIBA prepared references (the output directory of `ariba prepareref`). A prepared
+reference is kept in <cache_dir>/<key>, where key is the sha1 of the reference fasta, the
+metadata tsv and the ARIBA version, so it is built once per input and ARIBA version and found
+again by every runner and node sharing the cache directory. Builds are serialized by a lock
+file and moved into place only when complete; a cached reference is validated against the list
+of files recorded when it was built before it is used.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+from argparse import ArgumentParser
+from functools import lru_cache
+
+CACHE_DIR = "prepareref_cache"
+REF_FASTA = "out1.card.fa"
+REF_TSV = "out1.card.tsv"
+# written into a prepared reference once it is complete
+MANIFEST = "prepareref_cache.json"
+
+
+@lru_cache(maxsize=None)
+def ariba_version():
+    """Version of the installed ARIBA, e.g. '2.14.6'"""
+    out = subprocess.run(
+        ["ariba", "version"], check=True, capture_output=True, text=True
+    ).stdout
+    for line in out.splitlines():
+        if line.startswith("ARIBA version:"):
+            return line.split(":", 1)[1].strip()
+    return out.splitlines()[0].strip()
+
+
+def cache_key(fasta_path, tsv_path, version):
+    h = hashlib.sha1()
+    for path in (fasta_path, tsv_path):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                h.update(chunk)
+        h.update(b"\0")
+    h.update(version.encode())
+    return h.hexdigest()
+
+
+def _list_files(ref_dir):
+    files = {}
+    for root, _, names in os.walk(ref_dir):
+        for name in names:
+            path = os.path.join(root, name)
+            rel = os.path.relpath(path, ref_dir)
+            if rel != MANIFEST:
+                files[rel] = os.path.getsize(path)
+    return files
+
+
+def is_valid(ref_dir):
+    """True if ref_dir is a complete prepared reference whose files are as they were built"""
+    try:
+        with open(os.path.join(ref_dir, MANIFEST)) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return False
+    return all(
+        os.path.isfile(os.path.join(ref_dir, rel))
+        and os.path.getsize(os.path.join(ref_dir, rel)) == size
+        for rel, size in manifest["files"].items()
+    )
+
+
+def prepared_ref(
+    fasta_path=REF_FASTA, tsv_path=REF_TSV, cache_dir=CACHE_DIR, build=True
+):
+    """
+    Directory of the prepared reference of fasta_path and tsv_path, running
+    `ariba prepareref` first if it is not in the cache (unless build is False)
+    """
+    version = ariba_version()
+    key = cache_key(fasta_path, tsv_path, version)
+    ref_dir = os.path.join(cache_dir, key)
+    if is_valid(ref_dir) or not build:
+        return ref_dir
+    os.makedirs(cache_dir, exist_ok=True)
+    with open(ref_dir + ".lock", "w") as lock:
+        # another runner may be building the same reference
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        if is_valid(ref_dir):
+            return ref_dir
+        if os.path.isdir(ref_dir):
+            # incomplete or damaged
+            shutil.rmtree(ref_dir)
+        # ariba prepareref creates its output directory itself
+        tmp_dir = "{}.tmp{}".format(ref_dir, os.getpid())
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+        print(f"[INFO] Building prepared reference {ref_dir} (ARIBA {version})")
+        subprocess.run(
+            ["ariba", "prepareref", "-f", fasta_path, "-m", tsv_path, tmp_dir],
+            check=True,
+        )
+        manifest = {
+            "fasta": os.path.abspath(fasta_path),
+            "tsv": os.path.abspath(tsv_path),
+            "ariba_version": version,
+            "files": _list_files(tmp_dir),
+        }
+        with open(os.path.join(tmp_dir, MANIFEST), "w") as f:
+            json.dump(manifest, f, indent=1)
+        os.rename(tmp_dir, ref_dir)
+    return ref_dir
+
+
+def add_ref_args(parser):
+    """Add the reference options shared by the runners that call ariba run"""
+    parser.add_argument(
+        "--ref_fasta",
+        default=REF_FASTA,
+        help="Reference fasta, prepared through the cache (default: {})".format(
+            REF_FASTA
+        ),
+    )
+    parser.add_argument(
+        "--ref_tsv",
+        default=REF_TSV,
+        help="Reference metadata tsv (default: {})".format(REF_TSV),
+    )
+    parser.add_argument(
+        "--ref_cache",
+        default=CACHE_DIR,
+        help="Directory of the prepared reference cache (default: {})".format(
+            CACHE_DIR
+        ),
+    )
+    parser.add_argument(
+        "--prepareref",
+        default=None,
+        help="Use this prepared reference directory as is instead of the cache",
+    )
+
+
+def resolve_ref(args, build=True):
+    """Prepared reference directory selected by the options of add_ref_args()"""
+    if args.prepareref:
+        return args.prepareref
+    return prepared_ref(args.ref_fasta, args.ref_tsv, args.ref_cache, build)
+
+
+def getArgs():
+    parser = ArgumentParser(
+        prog="prepareref_cache.py",
+        description="Build (if needed) and print the cached ARIBA prepared reference of a fasta and metadata tsv.",
+    )
+    add_ref_args(parser)
+    return parser.parse_args()
+
+
+def main():
+    print(resolve_ref(getArgs()))
+
+
+if __name__ == "__main__":
+    main()
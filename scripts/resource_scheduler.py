@@ -0,0 +1,126 @@
+"""
+Core and memory admission for the external tools of the pipeline (fasterq-dump, ARIBA, ...).
+Every job asks the shared ResourceScheduler for its threads and memory before its subprocess is
+started and waits while the machine is fully booked, so the number of concurrent jobs follows
+from the resources instead of oversubscribing the cores. Utilization is logged per stage.
+"""
+
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+
+def total_memory_gb():
+    """Physical memory of the machine in GB"""
+    try:
+        import psutil
+
+        return psutil.virtual_memory().total / 1024**3
+    except ImportError:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / 1024**3
+
+
+class StageStats(object):
+    """Jobs, busy core-seconds and waiting time of one stage"""
+
+    def __init__(self):
+        self.running = 0
+        self.cores = 0
+        self.memory = 0.0
+        self.jobs = 0
+        self.core_seconds = 0.0
+        self.waited = 0.0
+
+
+class ResourceScheduler(object):
+    """
+    Budget of cores and memory (GB) shared by the jobs of all stages. reserve() blocks until
+    the requested resources are free and hands out the number of threads the job should use.
+    """
+
+    def __init__(self, cores=None, memory=None):
+        self.cores = cores or os.cpu_count() or 1
+        # leave some memory to the OS and this process
+        self.memory = memory if memory is not None else 0.9 * total_memory_gb()
+        self.used_cores = 0
+        self.used_memory = 0.0
+        self.stages = {}
+        self._cond = threading.Condition()
+        self._start = time.monotonic()
+
+    def _fits(self, cores, memory):
+        return (
+            self.used_cores + cores <= self.cores
+            and self.used_memory + memory <= self.memory
+        )
+
+    @contextmanager
+    def reserve(self, stage, cores=1, memory=0.0):
+        """
+        Hold cores and memory for one job of stage while the block runs and yield the number of
+        threads to give the job. Requests larger than the whole budget are capped to it.
+        """
+        cores = max(1, min(cores, self.cores))
+        memory = min(memory, self.memory)
+        t0 = time.monotonic()
+        with self._cond:
+            stats = self.stages.setdefault(stage, StageStats())
+            self._cond.wait_for(lambda: self._fits(cores, memory))
+            self.used_cores += cores
+            self.used_memory += memory
+            stats.running += 1
+            stats.cores += cores
+            stats.memory += memory
+            stats.waited += time.monotonic() - t0
+            self._log_usage(stage)
+        start = time.monotonic()
+        try:
+            yield cores
+        finally:
+            with self._cond:
+                self.used_cores -= cores
+                self.used_memory -= memory
+                stats.running -= 1
+                stats.cores -= cores
+                stats.memory -= memory
+                stats.jobs += 1
+                stats.core_seconds += cores * (time.monotonic() - start)
+                self._log_usage(stage)
+                self._cond.notify_all()
+
+    def _log_usage(self, stage):
+        stats = self.stages[stage]
+        logging.info(
+            "%s: %d jobs running on %d cores, %.1f GB; machine %d/%d cores, %.1f/%.1f GB",
+            stage,
+            stats.running,
+            stats.cores,
+            stats.memory,
+            self.used_cores,
+            self.cores,
+            self.used_memory,
+            self.memory,
+        )
+
+    def log_summary(self):
+        """Log the average core utilization of every stage since the scheduler was created"""
+        wall = max(time.monotonic() - self._start, 1e-9)
+        with self._cond:
+            for stage, stats in self.stages.items():
+                logging.info(
+                    "%s: %d jobs, %.1f%% of %d cores busy on average, %.1f s waited for resources",
+                    stage,
+                    stats.jobs,
+                    100.0 * stats.core_seconds / (wall * self.cores),
+                    self.cores,
+                    stats.waited,
+                )
+
+
+def reserve(scheduler, stage, cores=1, memory=0.0):
+    """scheduler.reserve(), or a context yielding cores as is when there is no scheduler"""
+    if scheduler is None:
+        return nullcontext(cores)
+    return scheduler.reserve(stage, cores, memory)
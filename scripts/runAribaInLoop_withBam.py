@@ -1,17 +1,36 @@
 import os
 import subprocess
 import shlex
+import logging
 from argparse import ArgumentParser
 from argparse import RawTextHelpFormatter
 from joblib import Parallel, delayed
+from resource_scheduler import ResourceScheduler, reserve
+from job_ledger import JobLedger, add_ledger_args, DONE
+from fastq_stream import find_reads
+from prepareref_cache import add_ref_args, resolve_ref
+from compact_ariba import compact_run
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
 
 def main():
-    file_sra, in_dir, out_dir, n_j, dry_run = getArgs()
-    sra_list = loadAccessions(file_sra)
-    Parallel(n_jobs=n_j, prefer="threads")(
-        delayed(runAriba)(sra, in_dir, out_dir, dry_run) for sra in sra_list
+    args = getArgs()
+    ledger = JobLedger(args.ledger)
+    # accessions recorded as done are skipped without looking at their output files
+    sra_list = ledger.select(loadAccessions(args.fileSRAs), "ariba", args.only_failed, args.only_pending)
+    logging.info("%d accessions to run ARIBA on", len(sra_list))
+    # built once here (or found in the cache) before the runs start, not by every run
+    ref_dir = resolve_ref(args, build=not args.dry_run)
+    logging.info("Prepared reference: %s", ref_dir)
+    # n_jobs bounds the concurrent runs, the scheduler only starts a run when its threads and memory are free
+    scheduler = ResourceScheduler(args.cores, args.total_memory)
+    Parallel(n_jobs=args.nJobs, prefer="threads")(
+        delayed(runAriba)(sra, args.inDir, args.outDir, args.dry_run, args.threads, scheduler, args.memory, ledger, ref_dir, args.compact, args.prune) for sra in sra_list
     )
+    scheduler.log_summary()
+    logging.info("ariba jobs: %s", ledger.summary("ariba"))
+    ledger.close()
 
 
 def loadAccessions(file_sra):
@@ -46,40 +65,90 @@ def getArgs():
     parser = ArgumentParser(
         formatter_class=RawTextHelpFormatter,
         prog="runAribaInLoop_withBam.py",
-        description="Run ARIBA for isolates to output variant report files and intermediate results.\n\nExample usage:\n  python runAribaInLoop_withBam.py -f output.json -i /path/to/fastqDir -o ./aribaResult/ -c 'ariba run out.card.prepareref {input1} {input2} {output}' -n 8 --dry_run\n",
+        description="Run ARIBA for isolates to output variant report files and intermediate results.\n\nExample usage:\n  python runAribaInLoop_withBam.py -f output.json -i /path/to/fastqDir -o ./aribaResult/ --ref_fasta out1.card.fa --ref_tsv out1.card.tsv -n 8 --dry_run\n",
     )
     parser.add_argument("-f", "--file", dest="fileSRAs", required=True, help="Path to file containing SRA accession list (JSON or TXT)")
     parser.add_argument("-i", "--input_dir", dest="inDir", required=True, help="Directory containing input FASTQ files")
     parser.add_argument("-o", "--output_dir", dest="outDir", required=True, help="Directory to store ARIBA results")
     parser.add_argument("-n", "--n_jobs", dest="nJobs", type=int, default=1, help="Number of parallel jobs (default: 1)")
+    parser.add_argument("-t", "--threads", type=int, default=1, help="Threads per ARIBA run (ariba run --threads, default: 1)")
+    parser.add_argument("--memory", type=float, default=2.0, help="GB of memory reserved per ARIBA run (default: 2.0)")
+    parser.add_argument("--cores", type=int, default=None, help="Cores shared by all runs (default: all cores)")
+    parser.add_argument("--total_memory", type=float, default=None, help="GB of memory shared by all runs (default: 90%% of RAM)")
     parser.add_argument("--dry_run", action="store_true", help="Print commands without executing them")
+    parser.add_argument("--compact", action="store_true", help="Compact each successful run to report.tsv + compact.npz (match flags, variant read depth windows)")
+    parser.add_argument("--prune", action="store_true", help="With --compact, delete the rest of the run directory (BAMs, assemblies, ...)")
+    add_ref_args(parser)
+    add_ledger_args(parser)
     args = parser.parse_args()
-    return args.fileSRAs, args.inDir, args.outDir, args.nJobs, args.dry_run
+    if args.prune and not args.compact:
+        parser.error("--prune requires --compact")
+    return args
 
 
-def runAriba(sra, in_dir, out_dir, dry_run):
+def runAriba(sra, in_dir, out_dir, dry_run, threads=1, scheduler=None, memory=2.0, ledger=None, ref_dir="out1.card.prepareref",
+             compact=False, prune=False):
+    """
+    Run ARIBA on the fastq pair of sra (plain, gzip-compressed or named pipes, see
+    fastq_stream.find_reads()) with the given number of threads and return its exit code
+    (0 if the report already exists, None if the fastq pair is missing or on a dry run).
+    With a scheduler (resource_scheduler.ResourceScheduler) the run waits until its threads and
+    memory are free; with a ledger (job_ledger.JobLedger) the run is recorded as stage "ariba".
+    ref_dir is the prepared reference, see prepareref_cache.prepared_ref(). With compact a successful
+    run is compacted right away (compact_ariba.compact_run()), with prune its bulky outputs are deleted.
+    """
     sra = sra.strip()
     fastq_dir = os.path.join(in_dir, "")
     reads1 = os.path.join(fastq_dir, f"{sra}_1.fastq")
     reads2 = os.path.join(fastq_dir, f"{sra}_2.fastq")
     out_run_dir = os.path.join(out_dir, f"outRun_{sra}")
+    if os.path.isfile(os.path.join(out_run_dir, "report.tsv")):
+        if ledger is not None:
+            ledger.mark(sra, "ariba", DONE)
+        return 0
     print(f"[DEBUG] Checking: '{reads1}' and '{reads2}'")
-    if os.path.isfile(reads1) and os.path.isfile(reads2):
-        if not os.path.isfile(os.path.join(out_run_dir, "report.tsv")):
-            if os.path.isdir(out_run_dir):
-                subprocess.run(["rm", "-r", out_run_dir])
+    reads = find_reads(sra, fastq_dir)
+    if reads is not None:
+        reads1, reads2 = reads
+        if os.path.isdir(out_run_dir):
+            subprocess.run(["rm", "-r", out_run_dir])
+        with reserve(scheduler, "ariba", threads, memory) as threads:
             # Always use a list for ARIBA command
             cmd = [
-                "ariba", "run", "out1.card.prepareref", reads1, reads2, out_run_dir
+                "ariba", "run", "--threads", str(threads), ref_dir, reads1, reads2, out_run_dir
             ]
             print(f"[INFO] Running: {' '.join(cmd)}")
-            if not dry_run:
-                with open("./aribaRunLog.txt", "a+") as f:
-                    subprocess.call(cmd)
+            if dry_run:
+                return None
+            if ledger is not None:
+                ledger.start(sra, "ariba")
+            with open("./aribaRunLog.txt", "a+") as f:
+                exit_code = subprocess.call(cmd)
+            if ledger is not None:
+                ledger.finish(sra, "ariba", exit_code, threads=threads, ref_dir=ref_dir)
+        if exit_code == 0 and compact:
+            compactRun(sra, out_run_dir, prune, ledger)
+        return exit_code
     else:
         print(f"[ERROR] Invalid path: {reads1} or {reads2}")
         with open("./sra_paired_read_notFound.txt", "a+") as l:
             l.write(sra + "\n")
+        if ledger is not None and not dry_run:
+            ledger.start(sra, "ariba")
+            ledger.finish(sra, "ariba", None, error="fastq pair not found")
+        return None
+
+
+def compactRun(sra, out_run_dir, prune=False, ledger=None):
+    """Compact a finished ARIBA run; a failed compaction is logged and leaves the run as it is"""
+    try:
+        size_before, size_after = compact_run(out_run_dir, prune=prune)
+    except Exception as e:
+        logging.error("%s: compaction failed: %s", sra, e)
+        return
+    logging.info("%s: compacted %.1f MB -> %.1f MB", sra, size_before / 1e6, size_after / 1e6)
+    if ledger is not None:
+        ledger.update_info(sra, "ariba", compact=True, bytes_before=size_before, bytes_after=size_after)
 
 
 if __name__ == "__main__":
@@ -1,6 +1,10 @@
 import os
 import subprocess
+from argparse import ArgumentParser
 from joblib import Parallel, delayed
+from job_ledger import JobLedger, add_ledger_args, DONE
+from fastq_stream import find_reads
+from resource_scheduler import ResourceScheduler, reserve
 
 # def main1(phyno):
 #    text = open(phyno).read()
@@ -13,16 +17,24 @@ from joblib import Parallel, delayed
 
 
 def main():
-    sra_list = loadAccessions()
-    n_sra = len(sra_list)
-    for i in range(0, n_sra):
-        print(sra_list[i])
-        print(i)
-        runMykrobe(sra_list[i])
-
-
-#    n_j=16
-#    Parallel(n_jobs=n_j, prefer="threads")(delayed(runMykrobe)(sra) for sra in sra_list)
+    args = getArgs()
+    ledger = JobLedger(args.ledger)
+    # accessions recorded as done are skipped without looking at their files
+    sra_list = ledger.select(
+        loadAccessions(), "mykrobe", args.only_failed, args.only_pending
+    )
+    print("{} accessions to run Mykrobe on".format(len(sra_list)))
+    # n_jobs bounds the concurrent runs, the scheduler only starts a run when its threads and memory are free
+    scheduler = ResourceScheduler(args.cores, args.total_memory)
+    Parallel(n_jobs=args.nJobs, prefer="threads")(
+        delayed(runMykrobe)(
+            sra, ledger, args.inDir, args.outDir, args.threads, scheduler, args.memory
+        )
+        for sra in sra_list
+    )
+    scheduler.log_summary()
+    print(ledger.summary("mykrobe"))
+    ledger.close()
 
 
 def loadAccessions():
@@ -38,18 +50,101 @@ def loadAccessions():
     return sra_list
 
 
-def runMykrobe(sra):
-    fastq_dir = "fastqDump/"
+def getArgs():
+    parser = ArgumentParser(
+        prog="run_Mykrobe_inLoop.py",
+        description="Run Mykrobe for the isolates in uniqueSRA.json.",
+    )
+    parser.add_argument(
+        "-i",
+        "--input_dir",
+        dest="inDir",
+        default="fastqDump/",
+        help="Directory of the fastq files (default: fastqDump/)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output_dir",
+        dest="outDir",
+        default="mykrobeOut",
+        help="Directory of the Mykrobe results (default: mykrobeOut)",
+    )
+    parser.add_argument(
+        "-n",
+        "--n_jobs",
+        dest="nJobs",
+        type=int,
+        default=1,
+        help="Number of parallel runs (default: 1)",
+    )
+    parser.add_argument(
+        "-t",
+        "--threads",
+        type=int,
+        default=10,
+        help="Threads per Mykrobe run (mykrobe predict -t, default: 10)",
+    )
+    parser.add_argument(
+        "--memory",
+        type=float,
+        default=4.0,
+        help="GB of memory reserved per Mykrobe run (default: 4.0)",
+    )
+    parser.add_argument(
+        "--cores",
+        type=int,
+        default=None,
+        help="Cores shared by all runs (default: all cores)",
+    )
+    parser.add_argument(
+        "--total_memory",
+        type=float,
+        default=None,
+        help="GB of memory shared by all runs (default: 90%% of RAM)",
+    )
+    add_ledger_args(parser)
+    return parser.parse_args()
+
+
+def mykrobe_result_path(sra, out_dir="mykrobeOut"):
+    return os.path.join(out_dir, "result_" + sra + ".csv")
+
+
+def runMykrobe(
+    sra,
+    ledger=None,
+    fastq_dir="fastqDump/",
+    out_dir="mykrobeOut",
+    threads=10,
+    scheduler=None,
+    memory=4.0,
+):
+    """
+    Run Mykrobe on the fastq pair of sra with the given number of threads and return its exit
+    code (0 if the result already exists, None if the fastq pair is missing). With a scheduler
+    (resource_scheduler.ResourceScheduler) the run waits until its threads and memory are free.
+    The run is recorded as stage "mykrobe" in the ledger.
+    """
+    fastq_dir = os.path.join(fastq_dir, "")
     reads1 = fastq_dir + sra + "_1.fastq"
     reads2 = fastq_dir + sra + "_2.fastq"
-    if os.path.isfile(reads1) and os.path.isfile(reads2):
-        out_file = "mykrobeOut/result_" + sra + ".csv"
-        if not (os.path.isfile(out_file)):
+    out_file = mykrobe_result_path(sra, out_dir)
+    # the reads may be gone already (fasterq_download.py --delete)
+    if os.path.isfile(out_file):
+        if ledger is not None:
+            ledger.mark(sra, "mykrobe", DONE)
+        return 0
+    # plain or gzip-compressed read pairs
+    reads = find_reads(sra, fastq_dir)
+    if reads is not None:
+        reads1, reads2 = reads
+        os.makedirs(out_dir, exist_ok=True)
+        with reserve(scheduler, "mykrobe", threads, memory) as threads:
             cmd = [
                 "mykrobe",
                 "predict",
                 "-t",
-                "10",
+                str(threads),
                 "--sample",
                 sra,
                 "--species",
@@ -64,10 +159,19 @@ def runMykrobe(sra):
             ]
             # print(cmd)
 
-            subprocess.call(cmd)
+            if ledger is not None:
+                ledger.start(sra, "mykrobe")
+            exit_code = subprocess.call(cmd)
+            if ledger is not None:
+                ledger.finish(sra, "mykrobe", exit_code, threads=threads)
+            return exit_code
 
     else:
         print("UGH! invalid path " + reads1 + " or " + reads2)
+        if ledger is not None:
+            ledger.start(sra, "mykrobe")
+            ledger.finish(sra, "mykrobe", None, error="fastq pair not found")
+        return None
 
 
 if __name__ == "__main__":
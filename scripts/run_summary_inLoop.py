@@ -3,14 +3,97 @@
 import os
 import subprocess
 import json
+import tempfile
 from pathlib import Path
 from argparse import ArgumentParser
 import logging
+import pandas as pd
+from joblib import Parallel, delayed
+from job_ledger import JobLedger, add_ledger_args, LEDGER_PATH, DONE
+from ariba_report import kept_rows, read_report, MIN_ID
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s: %(message)s")
 
+# cluster-level columns of ariba summary --preset all_no_filter, in their order
+CLUSTER_COLUMNS = ["assembled", "match", "ref_seq", "pct_id", "ctg_cov", "known_var", "novel_var"]
 
-def run_summary(sra_list_file="uniqueSRA.json", ariba_out_dir="aribaResult_withBam", summary_dir="summary_output_full"):
+
+def summary_cmd(out_prefix, reports, batch=False):
+    cmd = ["ariba", "summary", str(out_prefix)] + [str(r) for r in reports] + ["--preset", "all_no_filter"]
+    if batch:
+        # the phandango tree of thousands of samples is never used
+        cmd.append("--no_tree")
+    return cmd
+
+
+def is_up_to_date(report, out_csv):
+    """True if out_csv exists and is newer than report"""
+    return out_csv.exists() and out_csv.stat().st_mtime >= report.stat().st_mtime
+
+
+def report_clusters(report):
+    """Clusters ariba summary lists for a report: those with a row of at least MIN_ID percent identity"""
+    return set(kept_rows(read_report(report), MIN_ID)["cluster"])
+
+
+def split_summary(batch_csv, out_csvs):
+    """
+    Split the csv of an ariba summary run on several reports into one csv per report with the
+    cluster-level columns (assembled, match, ...) of the clusters of that report, i.e. the
+    '<cluster>.match' table an ariba summary run on the report alone writes. out_csvs maps the
+    report paths (the name column) to the csv to write.
+    """
+    df = pd.read_csv(batch_csv, sep=",", dtype=str, keep_default_na=False)
+    clusters = [c[: -len(".ref_seq")] for c in df.columns if c.endswith(".ref_seq")]
+    for _, row in df.iterrows():
+        # the batch table has columns for the clusters of every report
+        own = report_clusters(row["name"])
+        cols = ["name"] + [
+            f"{cluster}.{col}"
+            for cluster in clusters
+            if cluster in own
+            for col in CLUSTER_COLUMNS
+            if f"{cluster}.{col}" in df.columns
+        ]
+        out_csv = Path(out_csvs[row["name"]])
+        tmp_csv = out_csv.with_suffix(".csv.tmp")
+        row[cols].to_frame().T.to_csv(tmp_csv, index=False)
+        os.replace(tmp_csv, out_csv)
+
+
+def summarize_one(sra, report, summary_dir, ledger):
+    out_summary = Path(summary_dir) / f"{sra}_summary"
+    logging.info("%s: running ariba summary", sra)
+    ledger.start(sra, "summary")
+    ledger.finish(sra, "summary", subprocess.call(summary_cmd(out_summary, [report])))
+
+
+def summarize_batch(jobs, summary_dir, ledger):
+    """Run one ariba summary on the reports of jobs ((sra, report) pairs) and split its csv per accession"""
+    for sra, _ in jobs:
+        ledger.start(sra, "summary")
+    with tempfile.TemporaryDirectory(dir=summary_dir) as tmp:
+        prefix = Path(tmp) / "batch"
+        logging.info("running ariba summary on %d reports", len(jobs))
+        exit_code = subprocess.call(summary_cmd(prefix, [report for _, report in jobs], batch=True))
+        if exit_code == 0:
+            try:
+                split_summary(f"{prefix}.csv", {str(report): Path(summary_dir) / f"{sra}_summary.csv" for sra, report in jobs})
+            except Exception as e:
+                logging.error("splitting the summary of %d reports failed: %s", len(jobs), e)
+                exit_code = 1
+    for sra, _ in jobs:
+        ledger.finish(sra, "summary", exit_code, batch=len(jobs))
+
+
+def run_summary(sra_list_file="uniqueSRA.json", ariba_out_dir="aribaResult_withBam", summary_dir="summary_output_full",
+                ledger_path=LEDGER_PATH, only_failed=False, only_pending=False, workers=1, batch=1, force=False):
+    """
+    Run ariba summary --preset all_no_filter on the reports of the accessions, on workers threads
+    at a time. Accessions whose <sra>_summary.csv is newer than their report are skipped unless
+    force, whatever their ledger state. With batch > 1, one ariba summary process handles batch reports and its table is split
+    into the per-accession csv files (cluster-level columns only, see split_summary()).
+    """
     summary_path = Path(summary_dir)
     summary_path.mkdir(parents=True, exist_ok=True)
 
@@ -20,22 +103,33 @@ def run_summary(sra_list_file="uniqueSRA.json", ariba_out_dir="aribaResult_withB
         # fallback; each line an accession
         sra_list = [l.strip().strip('"') for l in open(sra_list_file).read().splitlines() if l.strip()]
 
+    ledger = JobLedger(ledger_path)
+    states = ledger.states("summary")
+    # accessions recorded as done are checked like the others, so a regenerated report (or --force)
+    # summarizes them again; only_failed / only_pending restrict the accessions to their ledger states
+    if only_failed or only_pending:
+        sra_list = ledger.select(sra_list, "summary", only_failed, only_pending)
+    jobs = []
     for sra in sra_list:
         report = Path(ariba_out_dir) / f"outRun_{sra}" / "report.tsv"
         if not report.exists():
             logging.info("%s: report not found, skipping", sra)
             continue
-        out_summary = Path(summary_dir) / f"{sra}_summary"
-        cmd = [
-            "ariba",
-            "summary",
-            str(out_summary),
-            str(report),
-            "--preset",
-            "all_no_filter",
-        ]
-        logging.info("%s: running ariba summary", sra)
-        subprocess.call(cmd)
+        if not force and is_up_to_date(report, summary_path / f"{sra}_summary.csv"):
+            if states.get(sra) != DONE:
+                ledger.mark(sra, "summary", DONE)
+            continue
+        jobs.append((sra, report))
+    logging.info("%d accessions to summarize", len(jobs))
+    if batch > 1:
+        batches = [jobs[i : i + batch] for i in range(0, len(jobs), batch)]
+        tasks = (delayed(summarize_batch)(b, summary_dir, ledger) for b in batches)
+    else:
+        tasks = (delayed(summarize_one)(sra, report, summary_dir, ledger) for sra, report in jobs)
+    # the work is done by the ariba processes, threads are enough to keep workers of them running
+    Parallel(n_jobs=workers, prefer="threads")(tasks)
+    logging.info("summary jobs: %s", ledger.summary("summary"))
+    ledger.close()
 
 
 if __name__ == "__main__":
@@ -43,5 +137,11 @@ if __name__ == "__main__":
     p.add_argument("-f", "--fSRAs", default="uniqueSRA.json", help="SRA list file")
     p.add_argument("-a", "--ariba_out", default="aribaResult_withBam", help="ARIBA output directory")
     p.add_argument("-s", "--summary_out", default="summary_output_full", help="summary output dir")
+    p.add_argument("-w", "--workers", type=int, default=1, help="Concurrent ariba summary processes (default: 1)")
+    p.add_argument("--batch", type=int, default=1,
+                   help="Reports per ariba summary process, split into per-accession match tables afterwards (default: 1, one process per report)")
+    p.add_argument("--force", action="store_true", help="Summarize again even if <sra>_summary.csv is newer than report.tsv")
+    add_ledger_args(p)
     args = p.parse_args()
-    run_summary(args.fSRAs, args.ariba_out, args.summary_out)
+    run_summary(args.fSRAs, args.ariba_out, args.summary_out, args.ledger, args.only_failed, args.only_pending,
+                args.workers, args.batch, args.force)
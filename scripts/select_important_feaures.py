@@ -1,95 +1,126 @@
 """select most important feature sets for the models of the 4 drugs,
 by trying different feature_imp_threshold.
 """
+
+from argparse import ArgumentParser
+
 import numpy as np
+from joblib import Parallel, delayed
 from sklearn.ensemble import RandomForestClassifier
-from sklearn import datasets
 from sklearn.model_selection import train_test_split
-from sklearn.feature_selection import SelectFromModel
 from sklearn.metrics import accuracy_score
 from sklearn.metrics import confusion_matrix
+from feature_dataset import load_dataset
 
-# Here, the order of features in feat_labels should be same as the order of the features in feature matrix 'featureM_X_drug.txt'
-feat_labels = np.loadtxt("raw_fList.txt", dtype=str)
-# print ("Number of full set of features: {}".format(len(feat_labels))  )
-# first line drugs
-drug_l = ["rifampicin", "isoniazid", "pyrazinamide", "ethambutol"]
-# second line drugs
-# drug_l = ['amikacin','capreomycin','kanamycin','ofloxacin']
-for drug in drug_l:
-    featureX = "featureM_X_" + drug + ".txt"
-    label = "label_Y_" + drug + ".txt"
-    X = np.loadtxt(featureX, dtype="i4")
-    y = np.loadtxt(label, dtype="i4")
-    f = 0
-    X_train, X_test, y_train, y_test = train_test_split(
-        X, y, test_size=0.1, random_state=0
-    )
-    clf = RandomForestClassifier(
-        n_estimators=1000, random_state=0, n_jobs=-1, class_weight="balanced"
-    )
-    clf.fit(X_train, y_train)
-    feature_imp_threshold = min(clf.feature_importances_)
-    ma = max(clf.feature_importances_)
-    # print ('The range of feature importances: {}-{}'.format(min(clf.feature_importances_),max(clf.feature_importances_)))
-    # for feature in zip(feat_labels, clf.feature_importances_):
-    #    print(feature)
-
-    # Apply The Full Featured Classifier To The Test Data
-    y_pred = clf.predict(X_test)
-
-    # View The Accuracy Of Our Full Feature set (283 Features) Model
-    a_fullF = accuracy_score(y_test, y_pred)
-    print("Using full set of features on drug {}".format(drug))
-    # print(a_fullF)
-    tn, fp, fn, tp = confusion_matrix(y_test, y_pred).ravel()
+
+def f_measure(y_true, y_pred):
+    tn, fp, fn, tp = confusion_matrix(y_true, y_pred).ravel()
     Precision = tp / float(tp + fp)
-    # print ('Precision:'+str(Precision))
     Recall = tp / float(tp + fn)
-    print("F-Measure:" + str(2 * (Recall * Precision) / (Recall + Precision)))
-    # print(tn, fp, fn, tp)
-
-    print("Using selected feature sets by iterating feature importance threshold")
-    # find the best feature_imp_threshold
-    while feature_imp_threshold < ma:
-        sfm = SelectFromModel(clf, threshold=feature_imp_threshold)
-        sfm.fit(X_train, y_train)
-
-        # Transform the data to create a new dataset containing only the most important features
-        # Note: We have to apply the transform to both the training X and test X data.
-        X_important_train = sfm.transform(X_train)
-        X_important_test = sfm.transform(X_test)
-
-        # Create a new random forest classifier for the most important features
-        clf_important = RandomForestClassifier(
-            n_estimators=1000, class_weight="balanced", random_state=0, n_jobs=-1
+    return 2 * (Recall * Precision) / (Recall + Precision)
+
+
+def cut_points(importances):
+    """
+    Distinct feature importances below the maximum in increasing order. SelectFromModel keeps the
+    features whose importance is >= threshold, so every threshold between two neighbouring values
+    selects the same features as the upper one and only these cut points need to be tried. As in
+    the former threshold loop (while threshold < max importance), the maximum is not tried.
+    """
+    return np.unique(importances)[:-1]
+
+
+def evaluate_selection(X_train, y_train, X_test, y_test, support):
+    """F-measure on the test data of a new random forest trained on the selected features only"""
+    # Create a new random forest classifier for the most important features; one job, the
+    # selections are evaluated in parallel
+    clf_important = RandomForestClassifier(
+        n_estimators=1000, class_weight="balanced", random_state=0, n_jobs=1
+    )
+    # Train the new classifier on the new dataset containing the most important features
+    clf_important.fit(X_train[:, support], y_train)
+    # Apply The selected Featured Classifier To The Test Data
+    y_important_pred = clf_important.predict(X_test[:, support])
+    return f_measure(y_test, y_important_pred)
+
+
+def sweep_thresholds(clf, X_train, y_train, X_test, y_test, workers=-1):
+    """
+    F-measure of the features selected at every cut point of the importances of the fitted clf,
+    as a list of (threshold, f_measure, support) in increasing threshold order. The cut points
+    select distinct feature sets, each is trained once, workers at a time.
+    """
+    importances = clf.feature_importances_
+    thresholds = cut_points(importances)
+    supports = [importances >= thr for thr in thresholds]
+    scores = Parallel(n_jobs=workers)(
+        delayed(evaluate_selection)(X_train, y_train, X_test, y_test, support)
+        for support in supports
+    )
+    return list(zip(thresholds, scores, supports))
+
+
+def getArgs():
+    parser = ArgumentParser(
+        prog="select_important_feaures.py",
+        description="Select the most important feature set of the models of the 4 first-line TB drugs.",
+    )
+    parser.add_argument(
+        "-w",
+        "--workers",
+        type=int,
+        default=-1,
+        help="Number of feature sets evaluated in parallel (default: -1, all cores)",
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    # print ("Number of full set of features: {}".format(len(feat_labels))  )
+    # first line drugs
+    drug_l = ["rifampicin", "isoniazid", "pyrazinamide", "ethambutol"]
+    # second line drugs
+    # drug_l = ['amikacin','capreomycin','kanamycin','ofloxacin']
+    for drug in drug_l:
+        # feat_labels are the names of the columns of X (raw_fList.txt for text datasets)
+        X, y, _, feat_labels = load_dataset(drug)
+        f = 0
+        X_train, X_test, y_train, y_test = train_test_split(
+            X, y, test_size=0.1, random_state=0
+        )
+        clf = RandomForestClassifier(
+            n_estimators=1000, random_state=0, n_jobs=-1, class_weight="balanced"
         )
+        clf.fit(X_train, y_train)
+        # print ('The range of feature importances: {}-{}'.format(min(clf.feature_importances_),max(clf.feature_importances_)))
+        # for feature in zip(feat_labels, clf.feature_importances_):
+        #    print(feature)
+
+        # Apply The Full Featured Classifier To The Test Data
+        y_pred = clf.predict(X_test)
+
+        # View The Accuracy Of Our Full Feature set (283 Features) Model
+        a_fullF = accuracy_score(y_test, y_pred)
+        print("Using full set of features on drug {}".format(drug))
+        # print(a_fullF)
+        print("F-Measure:" + str(f_measure(y_test, y_pred)))
+
+        print("Using selected feature sets by iterating feature importance threshold")
+        # find the best feature_imp_threshold among the distinct importances of clf; the
+        # selection of SelectFromModel(clf, threshold) is importances >= threshold
+        for feature_imp_threshold, f_selected, support in sweep_thresholds(
+            clf, X_train, y_train, X_test, y_test, args.workers
+        ):
+            print("{},{}".format(feature_imp_threshold, f_selected))
+            if f_selected > f:
+                f = f_selected
+                best_thr = feature_imp_threshold
+                best_support = support
+        print("Best f-measure: {}; best importance threashold: {}".format(f, best_thr))
+        for feature_list_index in np.flatnonzero(best_support):
+            print(feat_labels[feature_list_index])
+
 
-        # Train the new classifier on the new dataset containing the most important features
-        clf_important.fit(X_important_train, y_train)
-
-        # Apply The selected Featured Classifier To The Test Data
-
-        y_important_pred = clf_important.predict(X_important_test)
-        # View The Accuracy Of Our Limited Feature  Model
-        # a_selectedF=accuracy_score(y_test, y_important_pred)
-
-        # print('Feature importance threshold: {}'.format(feature_imp_threshold))
-        # print(a_selectedF)
-        tn, fp, fn, tp = confusion_matrix(y_test, y_important_pred).ravel()
-        Precision = tp / float(tp + fp)
-        # print ('Precision:'+str(Precision))
-        Recall = tp / float(tp + fn)
-        f_measure = 2 * (Recall * Precision) / (Recall + Precision)
-        print("{},{}".format(feature_imp_threshold, f_measure))
-        # print ('F-Measure:'+str(f_measure))
-        # print(tn, fp, fn, tp)
-        if f_measure > f:
-            f = f_measure
-            best_thr = feature_imp_threshold
-            best_selected_model = sfm
-
-        feature_imp_threshold += 0.0001
-    print("Best f-measure: {}; best importance threashold: {}".format(f, best_thr))
-    for feature_list_index in best_selected_model.get_support(indices=True):
-        print(feat_labels[feature_list_index])
+if __name__ == "__main__":
+    main()
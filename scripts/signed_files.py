@@ -0,0 +1,93 @@
+"""
+Signatures of the input files of the incremental stores (feature_store.py, ariba_rules.py,
+mykrobe_store.py). Every accession of a store is signed with the size/mtime of the files its
+entry was computed from and, optionally, a content hash to tell a touched file from a changed one,
+so a store only recomputes the accessions whose files changed.
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+
+def file_signature(*paths):
+    """(size, mtime) of every file in paths, flattened; (-1, -1) for a path that is None"""
+    sig = []
+    for path in paths:
+        if path is None:
+            sig.extend([-1, -1])
+            continue
+        st = os.stat(path)
+        sig.extend([st.st_size, st.st_mtime_ns])
+    return tuple(sig)
+
+
+def file_digest(*paths):
+    """sha1 of the content of the files in paths, paths that are None are skipped"""
+    h = hashlib.sha1()
+    for path in paths:
+        if path is None:
+            continue
+        with open(path, "rb") as f:
+            h.update(f.read())
+    return h.hexdigest()
+
+
+class SignedFiles(object):
+    """Signature (and content digest) of the n_files files each accession was computed from"""
+
+    def __init__(self, n_files, digests=True):
+        self.n_files = n_files
+        self.use_digests = digests
+        self.signatures = {}
+        self.digests = {}
+
+    def __contains__(self, sra):
+        return sra in self.signatures
+
+    def is_current(self, sra, *paths):
+        """
+        True if sra was signed with the current content of paths. Files whose mtime changed but
+        not their content are re-signed (with digests only).
+        """
+        if sra not in self.signatures:
+            return False
+        sig = file_signature(*paths)
+        if self.signatures[sra] == sig:
+            return True
+        if self.use_digests and self.digests[sra] == file_digest(*paths):
+            self.signatures[sra] = sig
+            return True
+        return False
+
+    def sign(self, sra, *paths):
+        self.signatures[sra] = file_signature(*paths)
+        if self.use_digests:
+            self.digests[sra] = file_digest(*paths)
+
+    def discard(self, sra):
+        self.signatures.pop(sra, None)
+        self.digests.pop(sra, None)
+
+    def arrays(self, accessions):
+        """The signatures (and digests) of accessions as arrays, to be saved with np.savez"""
+        arrays = {
+            "signatures": np.array(
+                [self.signatures[sra] for sra in accessions], dtype=np.int64
+            ).reshape(len(accessions), 2 * self.n_files)
+        }
+        if self.use_digests:
+            arrays["digests"] = np.array(
+                [self.digests[sra] for sra in accessions], dtype=str
+            )
+        return arrays
+
+    def load_arrays(self, accessions, data):
+        """Signatures (and digests) of accessions from the arrays saved by arrays()"""
+        signatures = data["signatures"].tolist()
+        digests = data["digests"].tolist() if self.use_digests else None
+        for i, sra in enumerate(accessions):
+            self.signatures[sra] = tuple(signatures[i])
+            if self.use_digests:
+                self.digests[sra] = digests[i]
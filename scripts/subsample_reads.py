@@ -0,0 +1,162 @@
+"""
+Downsampling of a read pair to a target depth before ARIBA. The depth is estimated from the
+number of sequenced bases and the genome size, and read pairs are kept with the probability
+target depth / depth, drawn from a random generator seeded with a fixed seed, so the same input
+always gives the same subsample. Plain and gzip-compressed fastq files are supported; the files
+are replaced by their subsample.
+"""
+
+import gzip
+import os
+import random
+import subprocess
+from argparse import ArgumentParser
+from contextlib import contextmanager
+
+from fastq_stream import compressor_cmd, fastq_records
+
+# length of the H37Rv reference genome
+GENOME_SIZE = 4411532
+
+
+def open_reads(path):
+    if path.endswith(".gz"):
+        return gzip.open(path, "rb")
+    return open(path, "rb")
+
+
+@contextmanager
+def open_output(path, compress=False, threads=1):
+    """Binary file to write fastq to, gzip-compressed by pigz/gzip if compress"""
+    with open(path, "wb") as f:
+        if not compress:
+            yield f
+            return
+        proc = subprocess.Popen(
+            compressor_cmd(threads), stdin=subprocess.PIPE, stdout=f
+        )
+        try:
+            yield proc.stdin
+        finally:
+            proc.stdin.close()
+            if proc.wait() != 0:
+                raise subprocess.CalledProcessError(proc.returncode, proc.args)
+
+
+def count_bases(reads1, reads2):
+    """Number of read pairs and of sequenced bases of both mates"""
+    n_pairs = 0
+    n_bases = 0
+    for k, path in enumerate((reads1, reads2)):
+        with open_reads(path) as f:
+            for record in fastq_records(f):
+                n_bases += len(record[1].rstrip())
+                if k == 0:
+                    n_pairs += 1
+    return n_pairs, n_bases
+
+
+def sampling_fraction(n_bases, target_depth, genome_size=GENOME_SIZE):
+    """(estimated depth, fraction of the read pairs to keep for target_depth)"""
+    depth = n_bases / genome_size
+    if depth <= target_depth:
+        return depth, 1.0
+    return depth, target_depth / depth
+
+
+def sample_pairs(reads1, reads2, out1, out2, fraction, seed=0, threads=1):
+    """
+    Write every read pair of reads1/reads2 to out1/out2 with probability fraction and return the
+    number of kept pairs and of their bases
+    """
+    rng = random.Random(seed)
+    kept = 0
+    kept_bases = 0
+    compress = reads1.endswith(".gz")
+    with open_reads(reads1) as in1, open_reads(reads2) as in2:
+        with open_output(out1, compress, threads) as o1, open_output(
+            out2, compress, threads
+        ) as o2:
+            for r1, r2 in zip(fastq_records(in1), fastq_records(in2)):
+                if rng.random() < fraction:
+                    o1.writelines(r1)
+                    o2.writelines(r2)
+                    kept += 1
+                    kept_bases += len(r1[1].rstrip()) + len(r2[1].rstrip())
+    return kept, kept_bases
+
+
+def subsample_to_depth(
+    reads1, reads2, target_depth, genome_size=GENOME_SIZE, seed=0, threads=1
+):
+    """
+    Downsample the read pair reads1/reads2 in place to about target_depth and return the depth
+    before and after, the sampling fraction and the numbers of read pairs. Files that are not
+    deeper than target_depth are left as they are.
+    """
+    n_pairs, n_bases = count_bases(reads1, reads2)
+    depth, fraction = sampling_fraction(n_bases, target_depth, genome_size)
+    stats = {
+        "depth": round(depth, 1),
+        "fraction": fraction,
+        "seed": seed,
+        "pairs": n_pairs,
+        "kept_pairs": n_pairs,
+        "depth_after": round(depth, 1),
+    }
+    if fraction >= 1.0:
+        return stats
+    tmp1, tmp2 = reads1 + ".tmp", reads2 + ".tmp"
+    try:
+        kept, kept_bases = sample_pairs(
+            reads1, reads2, tmp1, tmp2, fraction, seed, threads
+        )
+        os.replace(tmp1, reads1)
+        os.replace(tmp2, reads2)
+    finally:
+        for path in (tmp1, tmp2):
+            if os.path.exists(path):
+                os.unlink(path)
+    stats["kept_pairs"] = kept
+    stats["depth_after"] = round(kept_bases / genome_size, 1)
+    return stats
+
+
+def getArgs():
+    parser = ArgumentParser(
+        prog="subsample_reads.py",
+        description="Downsample a read pair in place to a target depth.",
+    )
+    parser.add_argument("reads1", help="fastq(.gz) file of the first mates")
+    parser.add_argument("reads2", help="fastq(.gz) file of the second mates")
+    parser.add_argument(
+        "-d",
+        "--target_depth",
+        type=float,
+        default=100,
+        help="Target depth (default: 100)",
+    )
+    parser.add_argument(
+        "-g",
+        "--genome_size",
+        type=int,
+        default=GENOME_SIZE,
+        help="Genome size in bp (default: {}, H37Rv)".format(GENOME_SIZE),
+    )
+    parser.add_argument(
+        "-s", "--seed", type=int, default=0, help="Random seed (default: 0)"
+    )
+    return parser.parse_args()
+
+
+def main():
+    args = getArgs()
+    print(
+        subsample_to_depth(
+            args.reads1, args.reads2, args.target_depth, args.genome_size, args.seed
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the scripts import each other by module name, as when run from scripts/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), os.pardir, "scripts"))
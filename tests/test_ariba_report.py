@@ -0,0 +1,46 @@
+"""
+data/ariba/report_summary.csv is the output of ARIBA 2.14.6 `ariba summary --preset all_no_filter`
+on data/ariba/report.tsv, an ARIBA report of these clusters:
+  rpoB  var_only gene with its known non-synonymous variant            yes, match yes
+  katG  var_only gene without its known variant                        yes, match no
+  embB  present gene on a contig that is not unique                    yes_nonunique, match yes
+  pncA  row below 90 % identity                                        not listed
+  gyrA  assembly failed, identity '.'                                  not listed
+  inhA  a row with identity '.' before a kept row                      yes, match yes
+  rrs   non-coding var_only reference with its known variant           yes, match yes
+  tlyA  assembled in pieces                                            fragmented, match no
+  ethA  one contig, incomplete gene                                    interrupted, match no
+"""
+
+import os
+
+from ariba_report import cluster_match, read_cluster_match, read_report
+from run_summary_inLoop import report_clusters, split_summary
+
+DATA = os.path.join(os.path.dirname(__file__), "data", "ariba")
+REPORT = os.path.join(DATA, "report.tsv")
+SUMMARY = os.path.join(DATA, "report_summary.csv")
+
+
+def test_cluster_match_equals_ariba_summary():
+    native = cluster_match(read_report(REPORT))
+    summary = read_cluster_match(SUMMARY)
+    assert native.sort_index().to_dict() == summary.sort_index().to_dict()
+    assert native["embB"] == "yes"
+    assert native["katG"] == "no"
+    assert "pncA" not in native and "gyrA" not in native
+
+
+def test_report_clusters_are_the_summary_clusters():
+    summary = read_cluster_match(SUMMARY)
+    assert report_clusters(REPORT) == set(summary.index)
+
+
+def test_split_summary_of_one_report(tmp_path, monkeypatch):
+    # the name column holds the report path ariba summary was given
+    monkeypatch.chdir(DATA)
+    out_csv = tmp_path / "SRR1_summary.csv"
+    split_summary(SUMMARY, {"report.tsv": out_csv})
+    assert read_cluster_match(str(out_csv)).to_dict() == (
+        read_cluster_match(SUMMARY).to_dict()
+    )
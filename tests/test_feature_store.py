@@ -0,0 +1,89 @@
+import os
+
+import pytest
+
+from feature_store import FeatureStore
+from get_feature_vector import lineage, update_feature_store
+
+COLUMNS = [
+    "cluster",
+    "ref_name",
+    "gene",
+    "var_only",
+    "flag",
+    "pc_ident",
+    "known_var",
+    "has_known_var",
+    "known_var_change",
+    "ref_ctg_change",
+    "ref_ctg_effect",
+    "free_text",
+    "var_description",
+]
+
+
+def write_report(sra, features):
+    """report.tsv of sra with one matched row per feature: a gene name or gene.change"""
+    path = os.path.join("aribaResult_withBam", "outRun_" + sra, "report.tsv")
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    rows = []
+    for feature in features:
+        gene, _, change = feature.partition(".")
+        known_var = "0" if change else "."
+        rows.append(
+            [gene, gene, "1", "0", "27", "99.0", known_var, "0", ".", change or "."]
+            + ["NONSYN" if change else ".", ".", "."]
+        )
+    with open(path, "w") as f:
+        f.write("\t".join(COLUMNS) + "\n")
+        for row in rows:
+            f.write("\t".join(row) + "\n")
+
+
+def rebuilt(sra_list):
+    store = FeatureStore(lineage)
+    update_feature_store(store, sra_list, native_match=True)
+    return store.cohort_rows(sra_list)
+
+
+@pytest.fixture
+def ariba_out(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    write_report("SRR1", ["rpoB", "rpoB.S450L"])
+    write_report("SRR2", ["katG", "katG.S315T", "katG.W191R", "rpoB"])
+    write_report("SRR3", ["embB", "embB.M306V"])
+
+
+def test_incremental_update_equals_rebuild(ariba_out, tmp_path):
+    store = FeatureStore(lineage)
+    update_feature_store(store, ["SRR1", "SRR2", "SRR3"], native_match=True)
+    store.save("feature_store.npz")
+
+    # SRR2 loses its katG features, SRR3 is gone and SRR4 is new
+    write_report("SRR2", ["rpoB", "rpoB.S450L"])
+    write_report("SRR4", ["embB", "pncA.H57D"])
+    os.remove(os.path.join("aribaResult_withBam", "outRun_SRR3", "report.tsv"))
+    cohort = ["SRR1", "SRR2", "SRR3", "SRR4"]
+
+    store = FeatureStore.load("feature_store.npz")
+    sra_withReport = update_feature_store(store, cohort, native_match=True)
+    vocab, indptr, indices = store.cohort_rows(sra_withReport)
+    rebuilt_vocab, rebuilt_indptr, rebuilt_indices = rebuilt(sra_withReport)
+
+    assert sra_withReport == ["SRR1", "SRR2", "SRR4"]
+    assert vocab.names == rebuilt_vocab.names
+    assert indptr.tolist() == rebuilt_indptr.tolist()
+    assert indices.tolist() == rebuilt_indices.tolist()
+    assert vocab.names[: len(lineage)] == lineage
+    assert not [name for name in vocab.names if name.startswith(("katG", "embB.M"))]
+
+
+def test_lineage_columns_stay_fixed(ariba_out):
+    store = FeatureStore(lineage)
+    update_feature_store(store, ["SRR1"], native_match=True)
+    write_report("SRR5", ["gyrA", "gyrA.D94G", "rrs.A1401G"])
+    update_feature_store(store, ["SRR1", "SRR5"], native_match=True)
+
+    vocab, _, _ = store.cohort_rows(["SRR1", "SRR5"])
+    assert store.vocab.names[: len(lineage)] == lineage
+    assert [vocab.index(name) for name in lineage] == list(range(len(lineage)))
@@ -0,0 +1,35 @@
+import pytest
+
+from mutation_catalogue import MutationCatalogue, normalize
+
+
+@pytest.mark.parametrize(
+    "mutation, expected",
+    [
+        ("Ser450Leu", "S450L"),
+        ("Gln432delinsLeu", "Q432L"),
+        ("Gln432_Asp435delinsHis", "Q432_D435delinsH"),
+        ("Gln432_Asp435delinsHisGly", "Q432_D435delinsHG"),
+        ("Q432_D435delinsH", "Q432_D435delinsH"),
+        ("Leu430_Pro431insArgGly", "L430_P431insRG"),
+        ("F433_T434insF", "F433dup"),
+    ],
+)
+def test_normalize(mutation, expected):
+    assert normalize(mutation) == expected
+
+
+def test_three_letter_delins_matches_one_letter_entry():
+    catalogue = MutationCatalogue()
+    catalogue.add("rpoB", "Q432_D435delinsH", ["rifampicin"])
+    assert catalogue.lookup("rpoB", "Gln432_Asp435delinsHis") == {"rifampicin"}
+
+
+def test_any_substitution_wildcard():
+    catalogue = MutationCatalogue()
+    catalogue.add("rpoB", "D435Var", ["rifampicin"])
+    assert catalogue.lookup("rpoB", "D435V") == {"rifampicin"}
+    assert catalogue.lookup("rpoB", "Asp435Tyr") == {"rifampicin"}
+    # synonymous changes, stop gains and other kinds of mutation are not substitutions
+    for mutation in ["D435D", "D435*", "Asp435Ter", "D435del", "D435fs"]:
+        assert catalogue.lookup("rpoB", mutation) is None